@@ -0,0 +1,511 @@
+"""
+Benchmark the read and write paths of MongoDBConnection.
+
+Seeds a collection with synthetic documents, times every public read and write method
+under each cache mode and writes a JSON report, so runs on different commits can be compared.
+
+Usage:
+    python benchmark.py --connection-string mongodb://localhost:27017 --sizes 1000 100000
+    python benchmark.py --mock --sizes 1000 10000        # in-process mongomock, no server
+
+--mock needs mongomock, which the app does not: pip install -r requirements-bench.txt
+    python benchmark.py --compare old_report.json        # compare with an earlier report
+
+Seeding 10^7 documents takes a few minutes and several GB of disk on the server.
+"""
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import random as rd
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import bson
+from faker import Faker
+import pandas as pd
+import pyarrow as pa
+import pymongo
+
+from mongodb_conn import MongoDBConnection, group_count_pipeline
+
+
+class PeakRSS:
+    """Context manager sampling the resident set size of the process while it is entered."""
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+
+    @staticmethod
+    def current() -> int:
+        """Return the resident set size of the process in bytes."""
+        try:
+            with open("/proc/self/statm") as statm:
+                return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        except OSError:
+            # without /proc, fall back to the peak of the whole process (KiB on Linux, bytes on macOS)
+            peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            return peak if platform.system() == "Darwin" else peak * 1024
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, self.current())
+
+    def __enter__(self) -> "PeakRSS":
+        self.peak = self.current()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, self.current())
+
+
+def seed(conn: MongoDBConnection, collection: pymongo.collection.Collection, size: int):
+    """Replace the benchmark collection with size synthetic documents."""
+    fake = Faker()
+    Faker.seed(0)
+    rd.seed(0)
+
+    # drawing from pools of fake values keeps seeding 10^7 documents fast
+    names = [fake.name() for _ in range(10_000)]
+    cities = [fake.city() for _ in range(500)]
+    start_date = datetime.datetime(2020, 1, 1)
+
+    collection.drop()
+    with conn.bulk() as bulk:
+        for i in range(size):
+            bulk.insert(
+                {
+                    "name": rd.choice(names),
+                    "age": rd.randint(18, 90),
+                    "city": rd.choice(cities),
+                    "score": rd.random() * 100,
+                    "created_at": start_date + datetime.timedelta(minutes=i),
+                }
+            )
+    collection.create_index("age")
+
+
+def workloads(size: int, collection: pymongo.collection.Collection) -> dict:
+    """Return the calls to benchmark, by name; each returns the number of documents it read."""
+    deep_page = max(size // 10 // 100, 1)
+    ids = [document["_id"] for document in collection.find({}, {"_id": 1}, limit=100)]
+
+    def _rows(result):
+        if isinstance(result, tuple):
+            result = result[0]
+        return result.num_rows if hasattr(result, "num_rows") else len(result)
+
+    def _keyset(conn):
+        # walk as many pages as paginate_documents skips to reach deep_page
+        token, rows = None, 0
+        for _ in range(deep_page):
+            page, token = conn.paginate_keyset(100, token)
+            rows += _rows(page)
+            if token is None:
+                break
+        return rows
+
+    def _sql(conn):
+        if conn.sql("SELECT 1 FROM _snapshots WHERE name = 'benchmark'").empty:
+            conn.snapshot("benchmark")
+        return _rows(conn.sql("SELECT city, count(*) FROM benchmark GROUP BY city"))
+
+    return {
+        "show_all_documents": lambda conn: _rows(conn.show_all_documents()),
+        "show_all_documents[arrow]": lambda conn: _rows(
+            conn.show_all_documents(result_format="arrow")
+        ),
+        "show_all_documents[partitions=4]": lambda conn: _rows(
+            conn.show_all_documents(partitions=4)
+        ),
+        "show_all_documents[arrow,partitions=4]": lambda conn: _rows(
+            conn.show_all_documents(result_format="arrow", partitions=4)
+        ),
+        "iter_batches": lambda conn: sum(len(batch) for batch in conn.iter_batches()),
+        "find": lambda conn: _rows(conn.find({"age": {"$gte": 60}})),
+        "find[arrow]": lambda conn: _rows(
+            conn.find({"age": {"$gte": 60}}, result_format="arrow")
+        ),
+        "find[compact]": lambda conn: _rows(
+            conn.find({"age": {"$gte": 60}}, result_format="compact")
+        ),
+        # find_one returns the document as a Series, empty when none matches
+        "find_one": lambda conn: int(not conn.find_one({"age": 42}).empty),
+        "get_many": lambda conn: sum(document is not None for document in conn.get_many(ids)),
+        "query": lambda conn: _rows(conn.query({"city": {"$exists": True}, "age": {"$lt": 30}})),
+        "count_documents": lambda conn: _rows([conn.count_documents({"age": {"$gte": 60}})]),
+        "distinct_values": lambda conn: len(conn.distinct_values("city")),
+        "aggregate": lambda conn: _rows(conn.aggregate(group_count_pipeline("city"))),
+        "paginate_documents": lambda conn: _rows(conn.paginate_documents(deep_page, 100)),
+        "paginate_keyset": _keyset,
+        "top_values": lambda conn: _rows(conn.top_values("city")),
+        "watch_frame": lambda conn: _rows(conn.watch_frame({"age": {"$gte": 60}})),
+        "snapshot": lambda conn: conn.snapshot("benchmark", full=True),
+        "sql": _sql,
+    }
+
+
+def run_workload(conn: MongoDBConnection, call, repeat: int) -> dict:
+    """Time repeated calls of one workload and measure the peak RSS they reach."""
+    latencies, rows = [], 0
+    with PeakRSS() as rss:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            rows += call(conn)
+            latencies.append(time.perf_counter() - start)
+
+    # with a cache, the first call is the miss and the following ones are hits
+    first_call = latencies[0]
+    latencies.sort()
+    total = sum(latencies)
+    return {
+        "calls": repeat,
+        "first_call_seconds": first_call,
+        "p50_seconds": statistics.median(latencies),
+        "p99_seconds": latencies[min(int(0.99 * repeat), repeat - 1)],
+        "calls_per_second": repeat / total if total else None,
+        "documents_per_second": rows / total if total else None,
+        "peak_rss_bytes": rss.peak,
+    }
+
+
+# the write methods, timed by run_writes
+WRITE_METHODS = (
+    "insert_document",
+    "insert_many_documents",
+    "update_document",
+    "update_documents",
+    "delete_document",
+    "delete_documents",
+    "bulk",
+)
+
+
+def run_writes(
+    conn: MongoDBConnection,
+    collection: pymongo.collection.Collection,
+    method: str,
+    repeat: int,
+    documents: int = 1000,
+) -> dict:
+    """
+    Time a write method, each call writing a batch of documents of its own (a single
+    document for the *_document methods). The documents updated or deleted are inserted
+    before the calls are timed, and every document written is removed afterwards.
+    """
+    batches = [
+        [{"name": f"write-{i}-{j}", "age": j % 90} for j in range(documents)]
+        for i in range(repeat)
+    ]
+    if method.startswith(("update_", "delete_")):
+        collection.insert_many([document for batch in batches for document in batch])
+
+    def _ids(i):
+        return {"$in": [document["_id"] for document in batches[i]]}
+
+    def _bulk(i):
+        with conn.bulk() as bulk:
+            for document in batches[i]:
+                bulk.insert(document)
+        return len(batches[i])
+
+    writes = {
+        "insert_document": lambda i: int(conn.insert_document(batches[i][0]).acknowledged),
+        "insert_many_documents": lambda i: len(
+            conn.insert_many_documents(batches[i]).inserted_ids
+        ),
+        "update_document": lambda i: conn.update_document(
+            {"_id": batches[i][0]["_id"]}, {"age": -1}
+        ).modified_count,
+        "update_documents": lambda i: conn.update_documents(
+            {"_id": _ids(i)}, {"age": -1}
+        ).modified_count,
+        "delete_document": lambda i: conn.delete_document(
+            {"_id": batches[i][0]["_id"]}
+        ).deleted_count,
+        "delete_documents": lambda i: conn.delete_documents({"_id": _ids(i)}).deleted_count,
+        "bulk": _bulk,
+    }
+    calls = iter(range(repeat))
+    result = run_workload(conn, lambda conn: writes[method](next(calls)), repeat)
+    collection.delete_many({"name": {"$regex": "^write-"}})
+    return result
+
+
+def transfer_workloads(
+    conn: MongoDBConnection, directory: str, schema: pa.Schema = None
+) -> dict:
+    """
+    Return the export and import calls to benchmark, with the list-of-dicts paths they replace.
+
+    The list-of-dicts export reads the documents with find and writes them with pandas; the
+    list-of-dicts import reads the file with pandas and inserts the rows with
+    insert_many_documents. Imports go to a separate collection, emptied before each call.
+    Exports use schema if given, instead of the key pass finding the fields.
+    """
+    target = conn.collection(f"{conn._instance.name}_import")
+    paths = {
+        "parquet": os.path.join(directory, "export.parquet"),
+        "arrow": os.path.join(directory, "export.arrow"),
+        "dicts": os.path.join(directory, "export-dicts.parquet"),
+    }
+
+    def _export_dicts(conn):
+        documents = list(conn._instance.find())
+        for document in documents:
+            document["_id"] = str(document["_id"])
+        pd.DataFrame(documents).to_parquet(paths["dicts"], index=False)
+        return len(documents)
+
+    def _import_dicts(conn):
+        if not os.path.exists(paths["dicts"]):
+            _export_dicts(conn)
+        target._instance.delete_many({})
+        documents = pd.read_parquet(paths["dicts"]).to_dict("records")
+        return len(target.insert_many_documents(documents).inserted_ids)
+
+    def _import_file(format):
+        def _import(conn):
+            if not os.path.exists(paths[format]):
+                conn.export(path=paths[format], schema=schema)
+            target._instance.delete_many({})
+            return target.import_file(paths[format])["documents"]
+
+        return _import
+
+    return {
+        "export[list-of-dicts]": _export_dicts,
+        "export[parquet]": lambda conn: conn.export(path=paths["parquet"], schema=schema)[
+            "documents"
+        ],
+        "export[arrow]": lambda conn: conn.export(path=paths["arrow"], schema=schema)[
+            "documents"
+        ],
+        "import[list-of-dicts]": _import_dicts,
+        "import_file[parquet]": _import_file("parquet"),
+        "import_file[arrow]": _import_file("arrow"),
+    }
+
+
+def raw_batches(documents, batch_size: int = 0):
+    """Encode documents into batches of concatenated BSON, as raw batch cursors return them."""
+    batch_size = batch_size or 101
+    batch = []
+    for document in documents:
+        batch.append(bson.encode(document))
+        if len(batch) == batch_size:
+            yield b"".join(batch)
+            batch = []
+    if batch:
+        yield b"".join(batch)
+
+
+def connect(args, cache: str) -> MongoDBConnection:
+    if args.mock and not hasattr(connect, "mock_client"):
+        import mongomock
+
+        # every connection shares one in-process server
+        connect.mock_client = mongomock.MongoClient()
+        pymongo.MongoClient = lambda *args, **kwargs: connect.mock_client
+
+        # mongomock has no raw batch cursors, which the Arrow paths read from
+        collection = mongomock.collection.Collection
+        collection.find_raw_batches = lambda self, *args, batch_size=0, **kwargs: raw_batches(
+            self.find(*args, **kwargs), batch_size
+        )
+        collection.aggregate_raw_batches = (
+            lambda self, pipeline, batch_size=0, **kwargs: raw_batches(
+                self.aggregate(pipeline, **kwargs), batch_size
+            )
+        )
+
+        # nor change streams: fail like a standalone server, so watch_frame polls
+        def _watch(self, *args, **kwargs):
+            raise pymongo.errors.OperationFailure(
+                "The $changeStream stage is only supported on replica sets", code=40573
+            )
+
+        collection.watch = _watch
+
+    return MongoDBConnection(
+        f"benchmark-{cache}",
+        connection_string=args.connection_string,
+        database=args.database,
+        collection_name=args.collection,
+        cache=cache,
+        # mongomock's distinct takes no maxTimeMS
+        max_time_ms=None if args.mock else 30_000,
+    )
+
+
+# run in a fresh interpreter, so the imports are not already loaded
+COLD_START_SCRIPT = """
+import json, sys, time
+
+options = json.loads(sys.argv[1])
+start = time.perf_counter()
+if options.pop("mock"):
+    import mongomock, pymongo
+
+    pymongo.MongoClient = mongomock.MongoClient
+import mongodb_conn
+
+imported = time.perf_counter()
+conn = mongodb_conn.MongoDBConnection("cold-start", cache="none", **options)
+connected = time.perf_counter()
+conn.count_documents({})
+done = time.perf_counter()
+print(json.dumps({
+    "import_seconds": imported - start,
+    "connect_seconds": connected - imported,
+    "first_query_seconds": done - start,
+}))
+"""
+
+
+def measure_cold_start(args, connect_in_background: bool) -> dict:
+    """Time importing the module, connecting and the first query in a new process."""
+    options = {
+        "mock": args.mock,
+        "connection_string": args.connection_string,
+        "database": args.database,
+        "collection_name": args.collection,
+        "connect_in_background": connect_in_background,
+    }
+    child = subprocess.run(
+        [sys.executable, "-c", COLD_START_SCRIPT, json.dumps(options)],
+        capture_output=True,
+        text=True,
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+    )
+    if child.returncode != 0:
+        return {"failed": child.stderr.strip().splitlines()[-1:]}
+    return json.loads(child.stdout.strip().splitlines()[-1])
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(report: dict, baseline: dict):
+    """Print the p50 latency ratio of every measurement present in both reports."""
+    def _key(result):
+        return result["size"], result["cache"], result["method"]
+
+    baseline_results = {_key(result): result for result in baseline["results"]}
+    print(f"{'size':>10} {'cache':>8} {'method':<28} {'baseline p50':>13} {'p50':>10} {'ratio':>7}")
+    for result in report["results"]:
+        before = baseline_results.get(_key(result))
+        if not before or "p50_seconds" not in result or "p50_seconds" not in before:
+            continue
+        ratio = result["p50_seconds"] / before["p50_seconds"] if before["p50_seconds"] else None
+        print(
+            f"{result['size']:>10} {result['cache']:>8} {result['method']:<28} "
+            f"{before['p50_seconds']:>13.5f} {result['p50_seconds']:>10.5f} "
+            f"{ratio if ratio is not None else float('nan'):>7.2f}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--connection-string", default="mongodb://localhost:27017")
+    parser.add_argument("--database", default="benchmark")
+    parser.add_argument("--collection", default="documents")
+    parser.add_argument("--mock", action="store_true", help="use mongomock instead of a server")
+    parser.add_argument(
+        "--sizes", type=int, nargs="+", default=[10**3, 10**4, 10**5],
+        help="collection sizes, e.g. 1000 10000 100000 1000000 10000000",
+    )
+    parser.add_argument(
+        "--caches", nargs="+", default=["none", "memory", "streamlit"],
+        help="cache modes to run (st.cache_data only caches inside a running Streamlit app, "
+        "elsewhere streamlit measures its overhead)",
+    )
+    parser.add_argument("--repeat", type=int, default=10, help="calls per measurement")
+    parser.add_argument("--methods", nargs="+", help="only run these workloads")
+    parser.add_argument("--output", default="benchmark_report.json")
+    parser.add_argument("--compare", help="an earlier report to compare the results with")
+    args = parser.parse_args()
+
+    report = {
+        "commit": git_commit(),
+        "created_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "pymongo": pymongo.version,
+        "server": "mongomock" if args.mock else args.connection_string.split("@")[-1],
+        "repeat": args.repeat,
+        "results": [],
+    }
+
+    # with --mock, importing mongomock loads pymongo before the module does
+    report["cold_start"] = {
+        mode: measure_cold_start(args, connect_in_background=mode == "background")
+        for mode in ("blocking", "background")
+    }
+    print("Cold start:", json.dumps(report["cold_start"], indent=2))
+
+    for size in args.sizes:
+        seed_conn = connect(args, "none")
+        collection = seed_conn.client[args.database][args.collection]
+        seed(seed_conn, collection, size)
+
+        for cache in args.caches:
+            conn = connect(args, cache)
+            directory = tempfile.mkdtemp(prefix="benchmark-")
+            # mongomock can't run the key pass of export, it has no $type expression
+            schema = conn.infer_schema() if args.mock else None
+            selected = {
+                name: call
+                for name, call in {
+                    **workloads(size, collection),
+                    **transfer_workloads(conn, directory, schema),
+                    **dict.fromkeys(WRITE_METHODS),
+                }.items()
+                if not args.methods or name in args.methods
+            }
+
+            for name, call in selected.items():
+                print(f"size={size} cache={cache} {name}", flush=True)
+                try:
+                    if call is None:
+                        result = run_writes(conn, collection, name, args.repeat)
+                    else:
+                        result = run_workload(conn, call, args.repeat)
+                except NotImplementedError as e:
+                    result = {"unsupported": str(e)}
+                report["results"].append({"size": size, "cache": cache, "method": name, **result})
+
+            conn.close_live_frames()
+            conn.collection(f"{args.collection}_import")._instance.drop()
+            shutil.rmtree(directory, ignore_errors=True)
+
+    with open(args.output, "w") as output:
+        json.dump(report, output, indent=2)
+    print(f"Report written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as baseline:
+            compare(report, json.load(baseline))
+
+
+if __name__ == "__main__":
+    main()
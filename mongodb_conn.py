@@ -1,102 +1,3740 @@
+from __future__ import annotations
+
+import time
+
+_IMPORT_STARTED = time.perf_counter()
+
+import asyncio
+import base64
+import collections
+import collections.abc
+import concurrent.futures
+import contextlib
+import copy
+import datetime
+import functools
+import hashlib
+import importlib
+import itertools
+import json
+import logging
+import math
+import os
+import statistics
+import sys
+import threading
+import types
+
+import streamlit as st
 from streamlit.connections import ExperimentalBaseConnection
 from streamlit.runtime.caching import cache_data
-import pymongo
-import pandas as pd
+from streamlit.runtime.scriptrunner import (
+    StopException,
+    add_script_run_ctx,
+    get_script_run_ctx,
+)
+import bson
+from bson import json_util
+from bson.codec_options import CodecOptions, TypeRegistry
+
+
+class _LazyModule(types.ModuleType):
+    """
+    A module imported on the first use of one of its attributes.
+
+    The import runs under a lock, so threads using the module for the first time at once
+    all get the fully loaded module (importlib's LazyLoader is not thread-safe before
+    Python 3.12.3). The module's attributes are then copied into this one, so later
+    lookups don't go through __getattr__.
+    """
+
+    def __init__(self, name: str):
+        super().__init__(name)
+        self._lazy_lock = threading.Lock()
+        self._lazy_module = None
+
+    def __getattr__(self, attribute: str):
+        module = self._lazy_module
+        if module is None:
+            with self._lazy_lock:
+                if self._lazy_module is None:
+                    loaded = importlib.import_module(self.__name__)
+                    self.__dict__.update(loaded.__dict__)
+                    self._lazy_module = loaded
+                module = self._lazy_module
+        # attributes set after the import, such as submodules imported later
+        return getattr(module, attribute)
+
+
+def _lazy_import(name: str):
+    """
+    Return a module that is only imported when one of its attributes is first used.
+
+    Keeps pymongo, duckdb and the other heavy dependencies out of the import time of this
+    module, so a page importing it can render before they are loaded. Modules already
+    imported (Streamlit imports pandas and pyarrow) are returned as they are.
+    """
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+    return _LazyModule(name)
+
+
+asizeof = _lazy_import("pympler.asizeof")
+cachetools = _lazy_import("cachetools")
+duckdb = _lazy_import("duckdb")
+np = _lazy_import("numpy")
+pa = _lazy_import("pyarrow")
+pd = _lazy_import("pandas")
+pq = _lazy_import("pyarrow.parquet")
+pymongo = _lazy_import("pymongo")
+tenacity = _lazy_import("tenacity")
+
+_LOGGER = logging.getLogger(__name__)
+
+# operators whose values are filters themselves, so their key order does not matter
+_FILTER_OPERATORS = ("$and", "$or", "$nor", "$elemMatch")
+
+# values BSON can't encode (e.g. a ClientSession) are fingerprinted by their repr
+_FINGERPRINT_CODEC_OPTIONS = CodecOptions(type_registry=TypeRegistry(fallback_encoder=repr))
+
+
+def _canonical(value, is_filter: bool = False):
+    """
+    Return a copy of a query value with a canonical key order.
+
+    Keys of filters and of operator documents ({"$gte": 1, "$lt": 5}) are sorted since
+    their order has no meaning. Embedded documents matched for equality keep their
+    order because {"a": 1, "b": 2} and {"b": 2, "a": 1} match different documents.
+    """
+    if isinstance(value, dict):
+        if is_filter or (value and all(key.startswith("$") for key in value)):
+            return {
+                key: _canonical(value[key], key in _FILTER_OPERATORS)
+                for key in sorted(value)
+            }
+        return value
+    if isinstance(value, (list, tuple)):
+        return [_canonical(item, is_filter) for item in value]
+    return value
+
+
+def _fingerprint(method: str, filter: dict = None, **options) -> str:
+    """
+    Compute the cache key of a read: a hash of the BSON encoding of its canonical form.
+
+    Parameters:
+    - method (str): The name of the connection method performing the read.
+    - filter (dict): The query filter.
+    - **options: Everything else that changes the result (projection, sort, limit, skip,
+      collation, hint, result format, ...). Options that are None are ignored.
+
+    Returns:
+    str: A hex digest identifying the read.
+    """
+    document = {"method": method, "filter": _canonical(filter or {}, is_filter=True)}
+    for name in sorted(options):
+        value = options[name]
+        if value is None:
+            continue
+        if name in ("projection", "collation") and isinstance(value, dict):
+            value = {key: value[key] for key in sorted(value)}
+        elif isinstance(value, pa.Schema):
+            value = value.serialize().to_pybytes()
+        document[name] = value
+
+    encoded = bson.encode(document, codec_options=_FINGERPRINT_CODEC_OPTIONS)
+    return hashlib.sha256(encoded).hexdigest()
+
+
+# the Python types Arrow types are picked for; bool comes before int, which it is a
+# subclass of
+_ARROW_KINDS = (bool, int, float, str, bytes, bson.ObjectId, datetime.datetime)
+
+# the kinds of the values of BSON types, by their $type names; the other types are objects
+_BSON_KINDS = {
+    "double": float,
+    "int": int,
+    "long": int,
+    "string": str,
+    "bool": bool,
+    "date": datetime.datetime,
+    "objectId": bson.ObjectId,
+    "binData": bytes,
+}
+
+
+def _arrow_kind(value):
+    """Return the Python type used to pick an Arrow type for a BSON value."""
+    for kind in _ARROW_KINDS:
+        if isinstance(value, kind):
+            return kind
+    return object
+
+
+# in compact schemas, string fields with at most this share of distinct values are
+# dictionary-encoded (categoricals in pandas)
+_CATEGORY_MAX_RATIO = 0.5
+
+
+def _infer_field(name: str, values: list, compact: bool = False) -> pa.Field:
+    """
+    Infer an Arrow field from the values one batch holds for a document field.
+
+    ObjectIds become 12-byte fixed binary columns tagged with ``bson_type`` metadata,
+    datetimes become millisecond timestamps (BSON's precision), and fields with mixed
+    or unsupported types fall back to strings. With compact, low-cardinality strings
+    are dictionary-encoded.
+    """
+    kinds = {_arrow_kind(value) for value in values if value is not None}
+    if kinds == {int, float}:
+        kinds = {float}
+    kind = kinds.pop() if len(kinds) == 1 else object
+
+    if kind is bson.ObjectId:
+        return pa.field(name, pa.binary(12), metadata={"bson_type": "objectId"})
+
+    if compact and kind is str:
+        present = [value for value in values if value is not None]
+        if len(set(present)) <= _CATEGORY_MAX_RATIO * len(present):
+            return pa.field(name, pa.dictionary(pa.int32(), pa.string()))
+
+    arrow_types = {
+        bool: pa.bool_(),
+        int: pa.int64(),
+        float: pa.float64(),
+        str: pa.string(),
+        bytes: pa.binary(),
+        datetime.datetime: pa.timestamp("ms"),
+    }
+    return pa.field(name, arrow_types.get(kind, pa.string()))
+
+
+def _flatten_document(document: dict, prefix: str = "") -> dict:
+    """Flatten nested subdocuments into dotted field names, {"a": {"b": 1}} into {"a.b": 1}."""
+    flat = {}
+    for name, value in document.items():
+        if isinstance(value, dict) and value:
+            flat.update(_flatten_document(value, f"{prefix}{name}."))
+        else:
+            flat[f"{prefix}{name}"] = value
+    return flat
+
+
+def _unflatten_document(document: dict) -> dict:
+    """Nest dotted field names into subdocuments, {"a.b": 1} into {"a": {"b": 1}}."""
+    nested = {}
+    for name, value in document.items():
+        *parents, leaf = name.split(".")
+        target = nested
+        for parent in parents:
+            if not isinstance(target.get(parent), dict):
+                target[parent] = {}
+            target = target[parent]
+        target[leaf] = value
+    return nested
+
+
+def _field_value(document: dict, name: str):
+    """Return the value of a document field, following dotted names into subdocuments."""
+    if name in document:
+        return document[name]
+
+    value = document
+    for part in name.split("."):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(part)
+    return value
+
+
+# MongoDB's sort order across BSON types: the $type name of each bracket and the Python
+# types of its values; values of different types compare by bracket, numbers with each other
+_BSON_SORT_ORDER = (
+    ("null", (type(None),)),
+    ("number", (int, float, bson.Decimal128)),
+    ("string", (str,)),
+    ("object", (dict,)),
+    ("array", (list,)),
+    ("binData", (bytes,)),
+    ("objectId", (bson.ObjectId,)),
+    ("bool", (bool,)),
+    ("date", (datetime.datetime,)),
+    ("timestamp", (bson.Timestamp,)),
+    ("regex", (bson.Regex,)),
+)
+
+
+def _sort_bracket(value) -> int:
+    """Return the position of a value's type in MongoDB's sort order, None for other types."""
+    for position, (_, kinds) in enumerate(_BSON_SORT_ORDER):
+        # bool is a subclass of int but sorts after the numbers
+        if isinstance(value, kinds) and not (isinstance(value, bool) and bool not in kinds):
+            return position
+    return None
+
+
+def _infer_schema(documents: list, compact: bool = False) -> pa.Schema:
+    """
+    Infer an Arrow schema from a batch of decoded documents.
+
+    With compact, subdocuments are flattened into dotted fields and low-cardinality
+    strings are dictionary-encoded, see _infer_field.
+    """
+    values = {}
+    for document in documents:
+        if compact:
+            document = _flatten_document(document)
+        for name, value in document.items():
+            values.setdefault(name, []).append(value)
+    return pa.schema(
+        [_infer_field(name, field_values, compact) for name, field_values in values.items()]
+    )
+
+
+def _schema_projection(schema: pa.Schema) -> dict:
+    """
+    Return the projection fetching only the fields of a schema.
+
+    Fields nested in another field of the schema are left out, since MongoDB rejects
+    projections holding both a path and one of its prefixes.
+    """
+    names = set(schema.names)
+
+    def _nested(name):
+        parts = name.split(".")
+        return any(".".join(parts[:i]) in names for i in range(1, len(parts)))
+
+    projection = {name: 1 for name in schema.names if not _nested(name)}
+    if "_id" not in names:
+        projection["_id"] = 0
+    return projection
+
+
+def _value_kinds(values: list) -> set:
+    """Return the kinds (see _arrow_kind) of the values of a field, None left out."""
+    kinds = set()
+    for value_type in set(map(type, values)):
+        if value_type is not type(None):
+            kinds.add(next((kind for kind in _ARROW_KINDS if issubclass(value_type, kind)), object))
+    return kinds
+
+
+def _type_accepts(arrow_type: pa.DataType, kinds: set) -> bool:
+    """Return whether values of the given kinds convert to an Arrow type without loss."""
+    if pa.types.is_string(arrow_type):
+        # anything else is written as its string or JSON form, see _to_arrow_array
+        return True
+    if pa.types.is_null(arrow_type):
+        accepted = set()
+    elif pa.types.is_dictionary(arrow_type):
+        accepted = {str}
+    elif pa.types.is_boolean(arrow_type):
+        accepted = {bool}
+    elif pa.types.is_integer(arrow_type):
+        accepted = {int}
+    elif pa.types.is_floating(arrow_type):
+        accepted = {int, float}
+    elif pa.types.is_fixed_size_binary(arrow_type) or pa.types.is_binary(arrow_type):
+        accepted = {bytes, bson.ObjectId}
+    elif pa.types.is_timestamp(arrow_type) or pa.types.is_date(arrow_type):
+        accepted = {datetime.datetime}
+    else:
+        # nested and other declared types are left to Arrow
+        return True
+    return kinds <= accepted
+
+
+def _widen_field(field: pa.Field, kinds: set, values: list, compact: bool = False) -> pa.Field:
+    """
+    Return a field of an inferred schema able to hold values of the given kinds.
+
+    A field with only nulls so far takes the type of the values, integers widen to floats,
+    and any other mismatch falls back to strings, as mixed types do in _infer_field.
+    """
+    if _type_accepts(field.type, kinds):
+        return field
+    if pa.types.is_null(field.type):
+        return _infer_field(field.name, values, compact)
+    if pa.types.is_integer(field.type) and kinds <= {int, float}:
+        return pa.field(field.name, pa.float64())
+    return pa.field(field.name, pa.string())
+
+
+def _to_arrow_array(values: list, field: pa.Field, kinds: set = None) -> pa.Array:
+    """
+    Convert the values of one document field into an Arrow array of the field's type.
+
+    Values the type can't hold without loss raise a ValueError, instead of the silent
+    casts of Arrow (floats truncated into integers).
+    """
+    if kinds is None:
+        kinds = _value_kinds(values)
+    if not _type_accepts(field.type, kinds):
+        raise ValueError(
+            f"Field '{field.name}' does not match its schema type {field.type}, it holds "
+            f"{', '.join(sorted(kind.__name__ for kind in kinds))} values; declare a schema "
+            "that fits them"
+        )
+
+    if pa.types.is_fixed_size_binary(field.type) or pa.types.is_binary(field.type):
+        values = [value.binary if isinstance(value, bson.ObjectId) else value for value in values]
+    elif pa.types.is_string(field.type):
+        values = [
+            value
+            if value is None or isinstance(value, str)
+            else json_util.dumps(value) if isinstance(value, (dict, list)) else str(value)
+            for value in values
+        ]
+
+    try:
+        return pa.array(values, type=field.type)
+    except (pa.ArrowInvalid, pa.ArrowTypeError) as e:
+        raise ValueError(
+            f"Field '{field.name}' does not match its schema type {field.type}; "
+            "declare a schema for collections with mixed field types"
+        ) from e
+
+
+def _documents_to_record_batch(
+    documents: list, schema: pa.Schema, widen: bool = False, compact: bool = False
+) -> pa.RecordBatch:
+    """
+    Build an Arrow record batch from decoded documents following the given schema.
+
+    Fields missing from a document become nulls, fields not in the schema are dropped.
+    Dotted field names select fields of subdocuments. With widen, fields whose type can't
+    hold the values are widened (see _widen_field) and the batch has the wider schema;
+    otherwise they raise a ValueError.
+    """
+    fields, columns = [], []
+    for field in schema:
+        values = [_field_value(document, field.name) for document in documents]
+        kinds = _value_kinds(values)
+        if widen:
+            field = _widen_field(field, kinds, values, compact)
+        fields.append(field)
+        columns.append(_to_arrow_array(values, field, kinds))
+    return pa.RecordBatch.from_arrays(columns, schema=pa.schema(fields, metadata=schema.metadata))
+
+
+def _iter_record_batches(
+    raw_batches, schema: pa.Schema = None, compact: bool = False, widen: bool = None
+):
+    """
+    Decode raw BSON batches, as returned by find_raw_batches, into Arrow record batches.
+
+    Only one server batch is decoded into Python objects at a time. If no schema is
+    given it is inferred from the first batch (see _infer_schema for compact) and applied
+    to all following batches. With widen, the default for inferred schemas, the schema
+    follows the documents: fields first seen in a later batch are appended to it, and
+    fields holding values their type can't are widened (see _widen_field). Later batches
+    may then carry more or wider fields than earlier ones; _widen_record_batch converts
+    the earlier ones. Without widen, such values raise a ValueError.
+    """
+    if widen is None:
+        widen = schema is None
+
+    for raw_batch in raw_batches:
+        documents = bson.decode_all(raw_batch)
+        if not documents:
+            continue
+        if schema is None:
+            schema = _infer_schema(documents, compact)
+        elif widen:
+            flat = [_flatten_document(document) for document in documents] if compact else documents
+            names = {name for document in flat for name in document}
+            if not names.issubset(schema.names):
+                new_fields = [
+                    field
+                    for field in _infer_schema(documents, compact)
+                    if field.name not in schema.names
+                ]
+                schema = pa.schema(list(schema) + new_fields, metadata=schema.metadata)
+        record_batch = _documents_to_record_batch(documents, schema, widen, compact)
+        schema = record_batch.schema
+        yield record_batch
+
+
+def _unify_schemas(schemas: list) -> pa.Schema:
+    """
+    Merge the schemas of record batches or tables decoded separately into one holding
+    all their fields, a field of different types taking the widest (see _widen_field).
+    """
+    fields = {}
+    for schema in schemas:
+        for field in schema:
+            known = fields.get(field.name)
+            if known is None or pa.types.is_null(known.type):
+                fields[field.name] = field
+            elif known.type == field.type or pa.types.is_null(field.type):
+                continue
+            elif all(
+                pa.types.is_integer(type) or pa.types.is_floating(type)
+                for type in (known.type, field.type)
+            ):
+                fields[field.name] = pa.field(field.name, pa.float64())
+            else:
+                fields[field.name] = pa.field(field.name, pa.string())
+    return pa.schema(list(fields.values()))
+
+
+def _widen_record_batch(record_batch: pa.RecordBatch, schema: pa.Schema) -> pa.RecordBatch:
+    """
+    Convert a record batch to a wider schema: its missing fields become null columns, and
+    its columns of a narrower type are converted to the schema's.
+    """
+    if record_batch.schema.equals(schema):
+        return record_batch
+
+    columns = []
+    for field in schema:
+        if field.name not in record_batch.schema.names:
+            columns.append(pa.nulls(record_batch.num_rows, field.type))
+            continue
+        column = record_batch.column(field.name)
+        if column.type != field.type:
+            values = column.to_pylist()
+            if record_batch.schema.field(field.name).metadata == {b"bson_type": b"objectId"}:
+                values = [bson.ObjectId(value) if value is not None else None for value in values]
+            column = _to_arrow_array(values, field)
+        columns.append(column)
+    return pa.RecordBatch.from_arrays(columns, schema=schema)
+
+
+def _raw_batches_to_table(
+    raw_batches, schema: pa.Schema = None, compact: bool = False, widen: bool = None
+) -> pa.Table:
+    """Decode raw BSON batches into a single Arrow table, see _iter_record_batches."""
+    record_batches = list(_iter_record_batches(raw_batches, schema, compact, widen))
+    if record_batches:
+        # the last batch carries every field found with its widest type, the schema only
+        # ever grows
+        schema = record_batches[-1].schema
+        record_batches = [_widen_record_batch(batch, schema) for batch in record_batches]
+
+    return pa.Table.from_batches(record_batches, schema=schema or pa.schema([]))
+
+
+def _cap_raw_batches(raw_batches, max_bytes: int, cut: dict):
+    """
+    Pass raw BSON batches through until max_bytes bytes have been read.
+
+    The batch crossing max_bytes is cut at a document boundary, found from the length
+    prefix of each BSON document, so nothing is decoded here. cut["reason"] is set to
+    "max_bytes", or to "max_time_ms" when the server time limit runs out after the first
+    batch (the error is raised if nothing was read).
+    """
+    size = 0
+    try:
+        for raw_batch in raw_batches:
+            if max_bytes is not None and size + len(raw_batch) > max_bytes:
+                end = 0
+                while end < len(raw_batch):
+                    length = int.from_bytes(raw_batch[end : end + 4], "little")
+                    if size + end + length > max_bytes:
+                        break
+                    end += length
+                if end:
+                    yield raw_batch[:end]
+                cut["reason"] = "max_bytes"
+                raw_batches.close()
+                return
+            size += len(raw_batch)
+            yield raw_batch
+    except pymongo.errors.ExecutionTimeout:
+        if not size:
+            raise
+        cut["reason"] = "max_time_ms"
+
+
+def _cap_documents(documents, max_bytes: int, cut: dict):
+    """
+    Pass documents from a cursor through until max_bytes bytes have been read.
+
+    Like _cap_raw_batches for decoded documents; their size is only measured (by encoding
+    them again) when max_bytes is set.
+    """
+    size = read = 0
+    try:
+        for document in documents:
+            if max_bytes is not None:
+                size += len(bson.encode(document))
+                if size > max_bytes:
+                    cut["reason"] = "max_bytes"
+                    documents.close()
+                    return
+            read += 1
+            yield document
+    except pymongo.errors.ExecutionTimeout:
+        if not read:
+            raise
+        cut["reason"] = "max_time_ms"
+
+
+def _cap_rows(rows, max_rows: int, cut: dict):
+    """Cut a list of documents or an Arrow table to max_rows rows, setting cut["reason"] if needed."""
+    if max_rows is None or len(rows) <= max_rows:
+        return rows
+    cut["reason"] = "max_rows"
+    return rows.slice(0, max_rows) if isinstance(rows, pa.Table) else rows[:max_rows]
+
+
+def _mark_truncated(result, reason: str):
+    """Flag a result cut short by a query guard limit, see truncated."""
+    if reason is None:
+        return result
+    if isinstance(result, pa.Table):
+        metadata = dict(result.schema.metadata or {})
+        metadata[b"truncated"] = reason.encode()
+        return result.replace_schema_metadata(metadata)
+    result.attrs["truncated"] = reason
+    return result
+
+
+def truncated(result) -> str:
+    """
+    Tell whether a read was cut short by the connection's query guard limits.
+
+    Parameters:
+    - result (pd.DataFrame | pa.Table | tuple): The result of a read method.
+
+    Returns:
+    str: The limit that was reached, "max_rows", "max_bytes" or "max_time_ms", or None if
+    the result is complete. DataFrames hold it in attrs["truncated"], Arrow tables in
+    their schema metadata.
+    """
+    if isinstance(result, tuple):
+        result = result[0]
+    if isinstance(result, (pa.Table, pa.RecordBatch)):
+        reason = (result.schema.metadata or {}).get(b"truncated")
+        return reason.decode() if reason else None
+    if isinstance(result, (pd.DataFrame, pd.Series)):
+        return result.attrs.get("truncated")
+    return None
+
+
+def _run_abandoned(ctx) -> bool:
+    """
+    Return whether a rerun or a stop of a Streamlit script run has been requested.
+
+    Streamlit only acts on these requests at the script's next st call, so a script
+    blocked in a read keeps waiting for it. Streamlit has no public API for the request
+    state, so this reads its ScriptRunner's; if that changes, no read is cancelled and
+    max_time_ms still bounds them.
+    """
+    runner = getattr(getattr(ctx, "_enqueue", None), "__self__", None)
+    state = getattr(getattr(runner, "_requests", None), "_state", None)
+    return getattr(state, "name", None) in ("RERUN", "STOP")
+
+
+class _ReadCancelled(StopException):
+    """Stops a script run whose read was cancelled because a rerun or a stop was requested."""
+
+
+class _UncachedResult(Exception):
+    """Carries a result out of st.cache_data, which does not cache calls that raise."""
+
+    def __init__(self, result):
+        super().__init__()
+        self.result = result
+
+
+def _record_batch_to_documents(record_batch: pa.RecordBatch) -> list:
+    """
+    Convert an Arrow record batch into documents, restoring ObjectId columns.
+
+    The conversion to Python objects is done column by column by Arrow, instead of row
+    by row. Columns tagged with bson_type "objectId" metadata become ObjectIds again.
+    """
+    documents = record_batch.to_pylist()
+
+    object_id_fields = [
+        field.name
+        for field in record_batch.schema
+        if field.metadata and field.metadata.get(b"bson_type") == b"objectId"
+    ]
+    for document in documents:
+        for name in object_id_fields:
+            if document[name] is not None:
+                document[name] = bson.ObjectId(document[name])
+
+    return documents
+
+
+# file formats of export and import_file, by file extension
+_FILE_FORMATS = {".parquet": "parquet", ".pq": "parquet", ".arrow": "arrow", ".feather": "arrow"}
+
+
+def _file_format(path: str, format: str = None) -> str:
+    """Return the file format of an export or import, "parquet" or "arrow"."""
+    if format is None:
+        format = _FILE_FORMATS.get(os.path.splitext(path)[1].lower())
+        if format is None:
+            raise ValueError(f"Cannot tell the format of '{path}' from its extension, pass format")
+    if format not in ("parquet", "arrow"):
+        raise ValueError(f"Unknown format '{format}', expected 'parquet' or 'arrow'")
+    return format
+
+
+def _compact_frame(table: pa.Table) -> pd.DataFrame:
+    """
+    Convert an Arrow result into a DataFrame with compact column dtypes.
+
+    Dictionary columns become categoricals, integers and booleans nullable Int64 and
+    boolean columns, strings Arrow-backed strings and timestamps datetime64. Binary
+    columns, ObjectIds included, stay Arrow fixed or variable-size binaries.
+    """
+
+    def _dtype(arrow_type: pa.DataType):
+        if pa.types.is_integer(arrow_type):
+            return pd.Int64Dtype()
+        if pa.types.is_boolean(arrow_type):
+            return pd.BooleanDtype()
+        if pa.types.is_string(arrow_type):
+            return pd.StringDtype("pyarrow")
+        if pa.types.is_fixed_size_binary(arrow_type) or pa.types.is_binary(arrow_type):
+            return pd.ArrowDtype(arrow_type)
+        # dictionaries, floats and timestamps keep their default conversion
+        return None
+
+    return table.to_pandas(types_mapper=_dtype)
+
+
+def _match_stage(match: dict) -> list:
+    """Return the $match stage starting a helper pipeline, if there is a filter."""
+    return [{"$match": match}] if match else []
+
+
+def group_count_pipeline(field: str, match: dict = None) -> list:
+    """
+    Build a pipeline counting the documents per value of a field, most frequent first.
+
+    Parameters:
+    - field (str): The field to group on; dotted paths are allowed.
+    - match (dict): A filter applied before grouping (default: None).
+
+    Returns:
+    list: The pipeline, producing one document per value with the value and its "count".
+    """
+    return _match_stage(match) + [
+        {"$group": {"_id": f"${field}", "count": {"$sum": 1}}},
+        {"$sort": {"count": pymongo.DESCENDING, "_id": pymongo.ASCENDING}},
+        {"$project": {"_id": 0, field.replace(".", "_"): "$_id", "count": 1}},
+    ]
+
+
+def top_n_pipeline(field: str, n: int = 10, match: dict = None) -> list:
+    """
+    Build a pipeline returning the n most frequent values of a field and their counts.
+
+    Parameters:
+    - field (str): The field to group on; dotted paths are allowed.
+    - n (int): The number of values to return.
+    - match (dict): A filter applied before grouping (default: None).
+
+    Returns:
+    list: The pipeline, producing at most n documents with the value and its "count".
+    """
+    pipeline = group_count_pipeline(field, match)
+    return pipeline[:-1] + [{"$limit": n}, pipeline[-1]]
+
+
+def histogram_pipeline(field: str, buckets: int = 10, match: dict = None) -> list:
+    """
+    Build a pipeline counting the documents in evenly filled buckets of a numeric field.
+
+    The bucket boundaries are picked by the server with $bucketAuto.
+
+    Parameters:
+    - field (str): The field to bucket; dotted paths are allowed.
+    - buckets (int): The number of buckets.
+    - match (dict): A filter applied before bucketing (default: None).
+
+    Returns:
+    list: The pipeline, producing one document per bucket with its "min", "max" and "count".
+    """
+    return _match_stage(match) + [
+        {"$bucketAuto": {"groupBy": f"${field}", "buckets": buckets}},
+        {"$project": {"_id": 0, "min": "$_id.min", "max": "$_id.max", "count": 1}},
+    ]
+
+
+def time_buckets_pipeline(
+    field: str, unit: str = "day", bin_size: int = 1, match: dict = None
+) -> list:
+    """
+    Build a pipeline counting the documents per time bucket of a date field.
+
+    Uses $dateTrunc, which requires MongoDB 5.0 or later.
+
+    Parameters:
+    - field (str): The date field to bucket; dotted paths are allowed.
+    - unit (str): The bucket unit: "year", "quarter", "month", "week", "day", "hour", "minute", ...
+    - bin_size (int): The number of units per bucket.
+    - match (dict): A filter applied before bucketing (default: None).
+
+    Returns:
+    list: The pipeline, producing one document per bucket with its "start" and "count", in time order.
+    """
+    return _match_stage(match) + [
+        {
+            "$group": {
+                "_id": {"$dateTrunc": {"date": f"${field}", "unit": unit, "binSize": bin_size}},
+                "count": {"$sum": 1},
+            }
+        },
+        {"$sort": {"_id": pymongo.ASCENDING}},
+        {"$project": {"_id": 0, "start": "$_id", "count": 1}},
+    ]
+
+
+# operators running JavaScript on the server, refused in typed queries
+_JAVASCRIPT_OPERATORS = ("$where", "$function", "$accumulator")
+
+
+def parse_query(text: str) -> dict:
+    """
+    Parse a filter typed by a user, written as MongoDB Extended JSON, without evaluating it.
+
+    Extended JSON types such as {"$oid": ...} and {"$date": ...} are decoded into their
+    BSON values. Operators running JavaScript on the server ($where, $function,
+    $accumulator) are refused.
+
+    Example:
+        conn.query(parse_query('{"age": {"$gte": 25}}'))
+
+    Parameters:
+    - text (str): The filter; empty text is the empty filter.
+
+    Returns:
+    dict: The filter.
+    """
+    if not text or not text.strip():
+        return {}
+
+    try:
+        query = json_util.loads(text)
+    except (ValueError, TypeError, bson.errors.BSONError) as e:
+        raise ValueError(f"Invalid query: {e}") from e
+    if not isinstance(query, dict):
+        raise ValueError('Invalid query, expected a JSON object such as {"age": {"$gte": 25}}')
+
+    def _check(value):
+        if isinstance(value, dict):
+            for name, item in value.items():
+                if name in _JAVASCRIPT_OPERATORS:
+                    raise ValueError(f"The {name} operator is not allowed in a query")
+                _check(item)
+        elif isinstance(value, list):
+            for item in value:
+                _check(item)
+
+    _check(query)
+    return query
+
+
+def _query_shape(value):
+    """Replace the values of a filter by 1, keeping its fields, operators and logical structure."""
+    if isinstance(value, collections.abc.Mapping):
+        return {
+            name: [_query_shape(item) for item in field]
+            if name in ("$and", "$or", "$nor") and isinstance(field, list)
+            else _query_shape(field)
+            for name, field in value.items()
+        }
+    return 1
+
+
+def _sort_pairs(sort) -> list:
+    """Normalize a sort given as a field name, a list of fields or (field, direction) pairs, or a dict."""
+    if not sort:
+        return []
+    if isinstance(sort, str):
+        return [(sort, pymongo.ASCENDING)]
+    if isinstance(sort, collections.abc.Mapping):
+        return list(sort.items())
+    return [tuple(key) if isinstance(key, (list, tuple)) else (key, pymongo.ASCENDING) for key in sort]
+
+
+def _suggest_index(filter: dict, sort=None) -> list:
+    """
+    Suggest the keys of an index serving a query, following the equality, sort, range rule.
+
+    Fields compared for equality come first, then the sort fields, then fields filtered by
+    ranges or other operators. Logical operators ($or, $and...) are not looked into.
+    """
+    equality, ranges = [], []
+    for name, value in (filter or {}).items():
+        if name.startswith("$"):
+            continue
+        operators = set(value) if isinstance(value, collections.abc.Mapping) else set()
+        if any(operator.startswith("$") for operator in operators) and not operators <= {"$eq"}:
+            ranges.append(name)
+        else:
+            equality.append(name)
+
+    keys = [(name, pymongo.ASCENDING) for name in equality]
+    keys += [(name, direction) for name, direction in _sort_pairs(sort) if name not in equality]
+    keys += [(name, pymongo.ASCENDING) for name in ranges if name not in dict(keys)]
+    return keys
+
+
+def _plan_stages(plan: dict) -> list:
+    """List the stages of a query plan from the root down, with the index each index scan uses."""
+    stages = []
+
+    def _walk(stage: dict):
+        name = stage.get("stage")
+        if name:
+            stages.append(f"{name} {stage['indexName']}" if "indexName" in stage else name)
+        children = [stage.get("inputStage"), stage.get("queryPlan"), *stage.get("inputStages", [])]
+        for child in children:
+            if child:
+                _walk(child)
+
+    _walk(plan)
+    return stages
+
+
+def _index_model(spec) -> pymongo.IndexModel:
+    """
+    Build an IndexModel from a declarative index spec.
+
+    A spec is a field name, a list of (field, direction) pairs, or a mapping with the
+    "keys" (a field name, pairs, or a {field: direction} mapping) and any other
+    createIndexes option, such as "name", "unique" or "expireAfterSeconds".
+    """
+    options = {}
+    keys = spec
+    if isinstance(spec, collections.abc.Mapping):
+        options = {name: value for name, value in spec.items() if name != "keys"}
+        keys = spec["keys"]
+    if isinstance(keys, collections.abc.Mapping):
+        keys = list(keys.items())
+    elif not isinstance(keys, str):
+        keys = [tuple(key) for key in keys]
+    return pymongo.IndexModel(keys, **options)
+
+
+def _ensure_indexes(collection: pymongo.collection.Collection, specs: list) -> list:
+    """
+    Create the indexes of specs missing from a collection, see _index_model.
+
+    Indexes are compared by their keys, so existing indexes are left as they are even if
+    their options differ from the spec.
+
+    Returns:
+    list: The names of the created indexes.
+    """
+
+    def _keys(key: dict) -> tuple:
+        # the server may report directions as floats
+        return tuple(
+            (name, int(direction) if isinstance(direction, float) else direction)
+            for name, direction in key.items()
+        )
+
+    existing = {_keys(index["key"]) for index in collection.list_indexes()}
+    missing = [
+        model
+        for model in map(_index_model, specs)
+        if _keys(model.document["key"]) not in existing
+    ]
+    return collection.create_indexes(missing) if missing else []
+
+
+def _result_size(value) -> int:
+    """Estimate the memory held by a query result, in bytes."""
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(deep=True, index=True).sum())
+    if isinstance(value, pd.Series):
+        return int(value.memory_usage(deep=True, index=True))
+    if isinstance(value, (pa.Table, pa.RecordBatch)):
+        return value.nbytes
+    if isinstance(value, tuple):
+        return sum(_result_size(item) for item in value)
+    return asizeof.asizeof(value)
+
+
+def _freeze_result(value):
+    """
+    Make the arrays of the DataFrames and Series of a result read-only before it is shared,
+    so modifying values in place through a view raises instead of changing it for every
+    reader. Returns the result.
+    """
+    if isinstance(value, tuple):
+        for item in value:
+            _freeze_result(item)
+    elif isinstance(value, (pd.DataFrame, pd.Series)):
+        for array in value._mgr.arrays:
+            # extension arrays (nullable, datetime, categorical) keep their data in numpy
+            # arrays of their own
+            parts = [array] + [getattr(array, name, None) for name in ("_ndarray", "_data", "_mask")]
+            for data in parts:
+                if isinstance(data, np.ndarray):
+                    data.flags.writeable = False
+    return value
+
+
+def _result_view(value):
+    """
+    Return a view of a cached result that shares its data instead of copying it.
+
+    Arrow tables are immutable and returned as they are. DataFrames and Series are
+    shallow copies of read-only data (see _freeze_result): adding or dropping columns
+    does not change the cached result, and modifying values in place raises ValueError.
+    """
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return value.copy(deep=False)
+    if isinstance(value, tuple):
+        items = [_result_view(item) for item in value]
+        # namedtuples such as CountEstimate keep their fields
+        return type(value)._make(items) if hasattr(value, "_fields") else tuple(items)
+    if isinstance(value, list):
+        return list(value)
+    return value
+
+
+CacheEntry = collections.namedtuple("CacheEntry", ["value", "size", "expires_at"])
+
+# an approximate count with the bounds of its confidence interval, see count_documents
+CountEstimate = collections.namedtuple("CountEstimate", ["value", "low", "high", "exact"])
+
+
+def _estimate_count(matched: int, sampled: int, total: int, confidence: float) -> CountEstimate:
+    """
+    Estimate how many of total documents match a filter from how many of a random sample did.
+
+    The bounds are the Wilson score interval of the matching share, which stays meaningful
+    when few or none of the sampled documents match.
+    """
+    share = matched / sampled
+    z = statistics.NormalDist().inv_cdf(0.5 + confidence / 2)
+    denominator = 1 + z**2 / sampled
+    center = (share + z**2 / (2 * sampled)) / denominator
+    margin = z / denominator * (share * (1 - share) / sampled + z**2 / (4 * sampled**2)) ** 0.5
+    return CountEstimate(
+        round(share * total),
+        max(matched, math.floor(total * max(center - margin, 0))),
+        math.ceil(total * min(center + margin, 1)),
+        False,
+    )
+
+
+def _frame_to_table(frame: pd.DataFrame) -> pa.Table:
+    """
+    Convert a DataFrame result into an Arrow table, keeping track of its ObjectId columns.
+
+    ObjectIds are stored as 12-byte binaries and the names of their columns are kept in
+    the schema metadata so _table_to_frame can restore them.
+    """
+    frame = frame.copy(deep=False)
+    object_id_columns = []
+    for column in frame.columns:
+        values = frame[column]
+        if values.dtype != object:
+            continue
+        present = values.dropna()
+        # optional fields hold NaN or None where they are missing, mixed columns are left
+        # to Arrow
+        if len(present) and all(isinstance(value, bson.ObjectId) for value in present):
+            frame[column] = [
+                value.binary if isinstance(value, bson.ObjectId) else None for value in values
+            ]
+            object_id_columns.append(column)
+
+    table = pa.Table.from_pandas(frame)
+    metadata = dict(table.schema.metadata or {})
+    metadata[b"objectid_columns"] = json.dumps(object_id_columns).encode()
+
+    # pandas cannot rebuild parametrized Arrow dtypes (the fixed binaries of compact results)
+    # or the storage of Arrow-backed strings from its metadata, so _table_to_frame restores
+    # these columns itself
+    arrow_columns = {}
+    for column in frame.columns:
+        dtype = frame[column].dtype
+        if isinstance(dtype, pd.ArrowDtype):
+            arrow_columns[str(column)] = None
+        elif isinstance(dtype, pd.StringDtype) and dtype.storage == "pyarrow":
+            arrow_columns[str(column)] = "string[pyarrow]"
+    if arrow_columns:
+        pandas_metadata = json.loads(metadata[b"pandas"])
+        for column in pandas_metadata["columns"]:
+            if column["name"] in arrow_columns:
+                column["numpy_type"] = "object"
+        metadata[b"pandas"] = json.dumps(pandas_metadata).encode()
+        metadata[b"arrow_columns"] = json.dumps(arrow_columns).encode()
+    if frame.attrs.get("truncated"):
+        metadata[b"truncated"] = frame.attrs["truncated"].encode()
+
+    return table.replace_schema_metadata(metadata)
+
+
+def _table_to_frame(table: pa.Table) -> pd.DataFrame:
+    """Convert a table written by _frame_to_table back into the original DataFrame."""
+    frame = table.to_pandas()
+    for column in json.loads(table.schema.metadata[b"objectid_columns"]):
+        frame[column] = [
+            bson.ObjectId(value) if value is not None else None for value in frame[column]
+        ]
+    arrow_columns = json.loads(table.schema.metadata.get(b"arrow_columns", b"{}"))
+    for column, dtype in arrow_columns.items():
+        if dtype is None:
+            frame[column] = pd.arrays.ArrowExtensionArray(table.column(column))
+        else:
+            frame[column] = frame[column].astype(dtype)
+    if b"truncated" in table.schema.metadata:
+        frame.attrs["truncated"] = table.schema.metadata[b"truncated"].decode()
+    return frame
+
+
+class DiskCache:
+    """
+    On-disk cache of query results as Arrow IPC files, shared by processes on one host.
+
+    Results survive restarts of the app, and loading one memory-maps its file so Arrow
+    results are not copied into memory. Arrow tables and DataFrames are cached, other
+    results are not. Files are written under a temporary name and renamed into place, so
+    several Streamlit processes can share a directory. The least recently used files are
+    removed once the directory holds more than max_bytes.
+
+    The directory also holds a generation token per collection, replaced on every write by
+    any of the processes (see bump), so cache keys built from it change for all of them.
+    """
+
+    def __init__(self, directory: str, max_bytes: int = 1024 * 1024 * 1024):
+        """
+        Parameters:
+        - directory (str): The directory holding the cached results; created if missing.
+        - max_bytes (int): The disk budget of the cached results, in bytes.
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(os.path.join(directory, "generations"), exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.arrow")
+
+    def _generation_path(self, namespace: str) -> str:
+        name = hashlib.sha256(namespace.encode()).hexdigest()
+        return os.path.join(self.directory, "generations", name)
+
+    def generation(self, namespace: str) -> str:
+        """
+        Return the generation token of a collection, shared by the processes using the directory.
+
+        Parameters:
+        - namespace (str): The full name of the collection.
+
+        Returns:
+        str: The token set by the last bump, empty if the collection was never written.
+        """
+        try:
+            with open(self._generation_path(namespace)) as file:
+                return file.read()
+        except OSError:
+            return ""
+
+    def bump(self, namespace: str):
+        """
+        Replace the generation token of a collection after a write.
+
+        Entries cached under the previous token are no longer looked up by any process and
+        are left to expire or be evicted.
+
+        Parameters:
+        - namespace (str): The full name of the collection.
+        """
+        path = self._generation_path(namespace)
+        temporary_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(temporary_path, "w") as file:
+                file.write(os.urandom(16).hex())
+            os.replace(temporary_path, path)
+        except OSError as e:
+            _LOGGER.warning("Writing the generation of %s to the disk cache failed: %s", namespace, e)
+            self._remove(temporary_path)
+
+    def get(self, key: str) -> CacheEntry:
+        """
+        Look up a cached result.
+
+        Parameters:
+        - key (str): The fingerprint of the read.
+
+        Returns:
+        CacheEntry: The entry holding the result, or None if it is missing or expired.
+        """
+        path = self._path(key)
+        try:
+            with pa.memory_map(path) as source:
+                table = pa.ipc.open_file(source).read_all()
+        except (OSError, pa.ArrowInvalid):
+            return None
+
+        metadata = dict(table.schema.metadata)
+        remaining = float(metadata.pop(b"cache_expires_at")) - time.time()
+        if remaining <= 0:
+            self._remove(path)
+            return None
+
+        # the modification time orders files for least recently used eviction
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+        result_type = metadata.pop(b"cache_result_type")
+        table = table.replace_schema_metadata(metadata or None)
+        value = _freeze_result(_table_to_frame(table)) if result_type == b"pandas" else table
+        return CacheEntry(value, _result_size(value), time.monotonic() + remaining)
+
+    def set(self, key: str, value, ttl: float = None):
+        """
+        Cache a result if it is an Arrow table or a DataFrame Arrow can hold; other results
+        are skipped, never failing the read.
+
+        Parameters:
+        - key (str): The fingerprint of the read.
+        - value: The result to cache.
+        - ttl (float): Time-to-live of the entry in seconds, None to keep it until evicted.
+        """
+        if isinstance(value, pd.DataFrame):
+            try:
+                table = _frame_to_table(value)
+            except Exception as e:
+                # the read still returns the result, it is only not kept on disk
+                _LOGGER.debug("A result can't be written to the disk cache: %s", e)
+                return
+            result_type = b"pandas"
+        elif isinstance(value, pa.Table):
+            table = value
+            result_type = b"arrow"
+        else:
+            return
+
+        expires_at = time.time() + ttl if ttl is not None else float("inf")
+        metadata = dict(table.schema.metadata or {})
+        metadata[b"cache_result_type"] = result_type
+        metadata[b"cache_expires_at"] = repr(expires_at).encode()
+        table = table.replace_schema_metadata(metadata)
+
+        path = self._path(key)
+        temporary_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with pa.OSFile(temporary_path, "wb") as sink:
+                with pa.ipc.new_file(sink, table.schema) as writer:
+                    writer.write_table(table)
+            os.replace(temporary_path, path)
+        except (OSError, pa.ArrowException) as e:
+            _LOGGER.warning("Writing a result to the disk cache failed: %s", e)
+            self._remove(temporary_path)
+            return
+
+        self._evict()
+
+    def _evict(self):
+        """Remove the least recently used files until the directory is within budget."""
+        files = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".arrow"):
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_bytes:
+                break
+            self._remove(path)
+            total -= size
+
+    @staticmethod
+    def _remove(path: str):
+        # another process may have removed it already
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def clear(self):
+        """Remove all cached results."""
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".arrow"):
+                self._remove(entry.path)
+
+
+class ResultCache:
+    """
+    In-process cache of query results, bounded by the memory the results take up.
+
+    Entries expire after their ttl and the least recently used entries are evicted once
+    the byte budget is exceeded. Results are stored as they are, without pickling, so a
+    hit costs a dictionary lookup. Any object with the same get/set/clear methods can be
+    used as the cache of a MongoDBConnection.
+
+    With a stale_ttl, expired entries are kept that much longer so they can be served
+    while they are refreshed (stale-while-revalidate). With a DiskCache, results are also
+    written to disk and results missing from memory are looked up there.
+    """
+
+    def __init__(
+        self,
+        max_bytes: int = 256 * 1024 * 1024,
+        stale_ttl: float = 0,
+        disk: DiskCache = None,
+    ):
+        """
+        Parameters:
+        - max_bytes (int): The memory budget of the cached results, in bytes.
+        - stale_ttl (float): How long expired entries can still be served, in seconds.
+        - disk (DiskCache): A disk tier under the memory cache (default: None).
+        """
+        self.max_bytes = max_bytes
+        self.stale_ttl = stale_ttl
+        self.disk = disk
+        self._entries = cachetools.TLRUCache(
+            maxsize=max_bytes,
+            ttu=lambda key, entry, now: entry.expires_at + self.stale_ttl,
+            timer=time.monotonic,
+            getsizeof=lambda entry: entry.size,
+        )
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> CacheEntry:
+        """
+        Look up a cached result.
+
+        Parameters:
+        - key (str): The fingerprint of the read.
+
+        Returns:
+        CacheEntry: The entry holding the result, or None if it is missing or past its
+        stale_ttl. The entry is stale if its expires_at has passed.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+
+        if entry is None and self.disk is not None:
+            entry = self.disk.get(key)
+            if entry is not None:
+                self._store(key, entry)
+
+        return entry
+
+    def _store(self, key: str, entry: CacheEntry):
+        # results larger than the whole budget are not cached
+        if entry.size > self.max_bytes:
+            return
+
+        with self._lock:
+            self._entries[key] = entry
+
+    def set(self, key: str, value, ttl: float = None):
+        """
+        Cache a result, evicting least recently used entries to stay within the budget.
+
+        Parameters:
+        - key (str): The fingerprint of the read.
+        - value: The result to cache.
+        - ttl (float): Time-to-live of the entry in seconds, None to keep it until evicted.
+        """
+        expires_at = time.monotonic() + ttl if ttl is not None else float("inf")
+        self._store(key, CacheEntry(value, _result_size(value), expires_at))
+
+        if self.disk is not None:
+            self.disk.set(key, value, ttl)
+
+    def clear(self):
+        """Remove all cached results."""
+        with self._lock:
+            self._entries.clear()
+        if self.disk is not None:
+            self.disk.clear()
+
+    def info(self) -> dict:
+        """
+        Return the number of cached results and the memory they take up.
+
+        Returns:
+        dict: The "entries", "bytes" and "max_bytes" of the cache.
+        """
+        with self._lock:
+            self._entries.expire()
+            return {
+                "entries": len(self._entries),
+                "bytes": self._entries.currsize,
+                "max_bytes": self.max_bytes,
+            }
+
+
+def _pinned_key(query: dict) -> tuple:
+    """Return the (field, value) of a query selecting documents by one field's value, else None."""
+    if not query or len(query) != 1:
+        return None
+    field, value = next(iter(query.items()))
+    if field.startswith("$"):
+        return None
+    if isinstance(value, collections.abc.Mapping):
+        if set(value) != {"$eq"}:
+            return None
+        value = value["$eq"]
+    if isinstance(value, (collections.abc.Mapping, list)):
+        return None
+    return field, value
+
+
+class DocumentCache:
+    """
+    In-process cache of single documents looked up by a unique field, see get_many.
+
+    Documents are cached per collection under their (field, value) key, expire after their
+    ttl, and the least recently used are evicted beyond max_documents per collection.
+    The connection's writes keep it consistent: an update of documents selected by one
+    field's value is written through to them, a delete selected that way evicts them,
+    and any other write evicts the whole collection.
+    """
+
+    def __init__(self, max_documents: int = 100_000):
+        """
+        Parameters:
+        - max_documents (int): The most documents cached per collection.
+        """
+        self.max_documents = max_documents
+        self._collections = {}
+        self._lock = threading.Lock()
+
+    def _entries(self, namespace: str) -> cachetools.TLRUCache:
+        # called with the lock held
+        entries = self._collections.get(namespace)
+        if entries is None:
+            entries = self._collections[namespace] = cachetools.TLRUCache(
+                maxsize=self.max_documents,
+                ttu=lambda key, entry, now: entry.expires_at,
+                timer=time.monotonic,
+            )
+        return entries
+
+    def get_many(self, namespace: str, field: str, values: list) -> dict:
+        """
+        Look up cached documents.
+
+        Parameters:
+        - namespace (str): The collection's full name.
+        - field (str): The unique field the documents are looked up by.
+        - values (list): The values of the field to look up.
+
+        Returns:
+        dict: The cached documents by value; values that are not cached are missing.
+        """
+        found = {}
+        with self._lock:
+            entries = self._entries(namespace)
+            for value in values:
+                entry = entries.get((field, value))
+                if entry is not None:
+                    found[value] = entry.value
+        return found
+
+    def set_many(self, namespace: str, field: str, documents: dict, ttl: float):
+        """
+        Cache documents by the value of the field they were looked up by.
+
+        Parameters:
+        - namespace (str): The collection's full name.
+        - field (str): The unique field the documents were looked up by.
+        - documents (dict): The documents by value.
+        - ttl (float): Time-to-live of the documents in seconds.
+        """
+        expires_at = time.monotonic() + ttl
+        with self._lock:
+            entries = self._entries(namespace)
+            for value, document in documents.items():
+                entries[(field, value)] = CacheEntry(document, 1, expires_at)
+
+    def _matching(self, entries: cachetools.TLRUCache, field: str, value) -> list:
+        return [
+            key for key, entry in entries.items() if _field_value(entry.value, field) == value
+        ]
+
+    def update(self, namespace: str, query: dict, update: dict, matched: bool = True):
+        """
+        Apply the $set of an update to the cached documents it matches.
+
+        Only updates selecting documents by one field's value are written through, and only
+        to documents selected by the field they are cached by (as it is unique) or by _id.
+        Documents whose key, or a nested field, is updated are evicted instead.
+
+        Parameters:
+        - namespace (str): The collection's full name.
+        - query (dict): The query of the update.
+        - update (dict): The fields set by the update.
+        - matched (bool): Whether the update matched a document on the server.
+        """
+        pinned = _pinned_key(query)
+        if pinned is None:
+            self.clear(namespace)
+            return
+        if not matched:
+            self.discard(namespace, query)
+            return
+
+        field, value = pinned
+        with self._lock:
+            entries = self._entries(namespace)
+            for key in self._matching(entries, field, value):
+                entry = entries[key]
+                key_field = key[0]
+                if field in ("_id", key_field) and key_field not in update and not any(
+                    "." in name for name in update
+                ):
+                    entries[key] = entry._replace(value={**entry.value, **update})
+                else:
+                    del entries[key]
+
+    def discard(self, namespace: str, query: dict):
+        """
+        Evict the cached documents a delete may remove.
+
+        Parameters:
+        - namespace (str): The collection's full name.
+        - query (dict): The query of the delete.
+        """
+        pinned = _pinned_key(query)
+        if pinned is None:
+            self.clear(namespace)
+            return
+
+        with self._lock:
+            entries = self._entries(namespace)
+            for key in self._matching(entries, *pinned):
+                del entries[key]
+
+    def clear(self, namespace: str = None):
+        """Remove the cached documents of a collection, or of all collections."""
+        with self._lock:
+            if namespace is None:
+                self._collections.clear()
+            else:
+                self._collections.pop(namespace, None)
+
+    def info(self) -> dict:
+        """
+        Return the number of cached documents.
+
+        Returns:
+        dict: The "entries" of the cache and its "max_documents" per collection.
+        """
+        with self._lock:
+            for entries in self._collections.values():
+                entries.expire()
+            return {
+                "entries": sum(len(entries) for entries in self._collections.values()),
+                "max_documents": self.max_documents,
+            }
+
+
+class BulkWriter:
+    """
+    Buffer writes and send them to MongoDB in bulk_write batches.
+
+    Batches are sized by the BSON size of their operations, run unordered by default and
+    are retried with exponential backoff on transient network errors. Use it through
+    MongoDBConnection.bulk(), as a context manager that sends the last batch on exit.
+    """
+
+    # MongoDB's maxWriteBatchSize
+    MAX_BATCH_OPERATIONS = 100_000
+
+    def __init__(
+        self,
+        connection: "MongoDBConnection",
+        batch_bytes: int = 8 * 1024 * 1024,
+        ordered: bool = False,
+        retries: int = 3,
+    ):
+        """
+        Parameters:
+        - connection (MongoDBConnection): The connection (or collection handle) to write to.
+        - batch_bytes (int): The BSON size at which a batch is sent, in bytes.
+        - ordered (bool): Stop a batch at the first error instead of applying all valid operations.
+        - retries (int): How many times a batch is retried after a transient error.
+        """
+        self.connection = connection
+        self.batch_bytes = batch_bytes
+        self.ordered = ordered
+        self.retries = retries
+        self.report = []
+        self._operations = []
+        self._pending_bytes = 0
+
+    def __enter__(self) -> "BulkWriter":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.flush()
+
+    def _add(self, operation, *documents):
+        self._operations.append(operation)
+        self._pending_bytes += sum(len(bson.encode(document)) for document in documents)
+
+        if (
+            self._pending_bytes >= self.batch_bytes
+            or len(self._operations) >= self.MAX_BATCH_OPERATIONS
+        ):
+            self.flush()
+
+    def insert(self, document: dict):
+        """Queue the insertion of a document."""
+        self._add(pymongo.InsertOne(document), document)
+
+    def upsert(self, query: dict, update: dict):
+        """Queue setting the fields of update on the document matching query, inserting it if missing."""
+        self._add(pymongo.UpdateOne(query, {"$set": update}, upsert=True), query, update)
+
+    def update(self, query: dict, update: dict, many: bool = False):
+        """Queue setting the fields of update on the first (or every) document matching query."""
+        operation = pymongo.UpdateMany if many else pymongo.UpdateOne
+        self._add(operation(query, {"$set": update}), query, update)
+
+    def delete(self, query: dict, many: bool = False):
+        """Queue the deletion of the first (or every) document matching query."""
+        operation = pymongo.DeleteMany if many else pymongo.DeleteOne
+        self._add(operation(query), query)
+
+    def insert_frame(self, frame: pd.DataFrame, chunk_rows: int = 10_000):
+        """
+        Queue the insertion of every row of a DataFrame as a document.
+
+        The rows are converted to documents by Arrow one chunk at a time, with missing
+        values becoming nulls, instead of row by row with DataFrame.to_dict.
+
+        Parameters:
+        - frame (pd.DataFrame): The rows to insert; the index is not inserted.
+        - chunk_rows (int): The number of rows converted at a time.
+        """
+        try:
+            table = pa.Table.from_pandas(frame, preserve_index=False)
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            # columns Arrow can't hold (e.g. ObjectIds) are converted by pandas
+            for start in range(0, len(frame), chunk_rows):
+                for document in frame.iloc[start : start + chunk_rows].to_dict("records"):
+                    self.insert(document)
+            return
+
+        for record_batch in table.to_batches(max_chunksize=chunk_rows):
+            for document in _record_batch_to_documents(record_batch):
+                self.insert(document)
+
+    def flush(self):
+        """Send the queued operations as one bulk_write batch and record its throughput."""
+        if not self._operations:
+            return
+
+        operations, size = self._operations, self._pending_bytes
+        self._operations, self._pending_bytes = [], 0
+
+        attempts = 0
+
+        def _write():
+            nonlocal attempts
+            attempts += 1
+            counts = dict.fromkeys(("inserted", "upserted", "modified", "deleted"), 0)
+            pending = operations
+            while pending:
+                try:
+                    result = self.connection._instance.bulk_write(pending, ordered=self.ordered)
+                except pymongo.errors.BulkWriteError as e:
+                    # on a retry, inserts the failed attempt already applied fail with a
+                    # duplicate _id; any other error is a real one
+                    errors = e.details.get("writeErrors", [])
+                    if attempts == 1 or not errors or not all(
+                        self._already_inserted(pending[error["index"]], error) for error in errors
+                    ):
+                        raise
+                    counts["inserted"] += e.details["nInserted"] + len(errors)
+                    counts["upserted"] += e.details["nUpserted"]
+                    counts["modified"] += e.details["nModified"]
+                    counts["deleted"] += e.details["nRemoved"]
+                    # an ordered batch stops at its first error, the rest is sent again
+                    pending = pending[errors[-1]["index"] + 1 :] if self.ordered else []
+                else:
+                    counts["inserted"] += result.inserted_count
+                    counts["upserted"] += result.upserted_count
+                    counts["modified"] += result.modified_count
+                    counts["deleted"] += result.deleted_count
+                    pending = []
+            return counts
+
+        start = time.perf_counter()
+        try:
+            counts = tenacity.Retrying(
+                retry=tenacity.retry_if_exception_type(pymongo.errors.AutoReconnect),
+                wait=tenacity.wait_exponential(multiplier=0.1, max=5),
+                stop=tenacity.stop_after_attempt(self.retries + 1),
+                reraise=True,
+            )(_write)
+        finally:
+            self.connection._bump_generation()
+        seconds = time.perf_counter() - start
+
+        self.report.append(
+            {
+                "operations": len(operations),
+                "bytes": size,
+                "seconds": seconds,
+                "operations_per_second": len(operations) / seconds if seconds else None,
+                "attempts": attempts,
+                **counts,
+            }
+        )
+
+    @staticmethod
+    def _already_inserted(operation, error: dict) -> bool:
+        """
+        Tell whether a write error of a retried batch is an insert of the failed attempt.
+
+        Every operation of the failed attempt may have reached the server, and pymongo sets
+        the _id of inserted documents before sending them, so the retry sends the same _id:
+        only a duplicate key error on the _id of an insert is one.
+        """
+        if error.get("code") != 11000 or not isinstance(operation, pymongo.InsertOne):
+            return False
+        if "keyPattern" in error:
+            return list(error["keyPattern"]) == ["_id"]
+        return "index: _id_ " in error.get("errmsg", "")
+
+
+class LiveFrame:
+    """
+    A query result kept up to date by applying the collection's changes as they happen.
+
+    The matching documents are loaded once into a DataFrame indexed by _id. A background
+    thread then tails a change stream on the collection and, for each batch of changed
+    documents, fetches only those documents again and inserts, updates or removes their
+    rows. Where change streams are not available (standalone servers), the result is
+    reloaded every poll_interval seconds instead. Use it through
+    MongoDBConnection.watch_frame().
+    """
+
+    # change stream events replacing the whole result
+    _RELOAD_EVENTS = ("drop", "rename", "dropDatabase", "invalidate")
+
+    def __init__(
+        self,
+        connection: "MongoDBConnection",
+        filter: dict = None,
+        projection: dict = None,
+        mode: str = "auto",
+        poll_interval: float = 5.0,
+        max_batch: int = 1000,
+    ):
+        """
+        Parameters:
+        - connection (MongoDBConnection): The connection (or collection handle) to read.
+        - filter (dict): The filter selecting the documents (default: None).
+        - projection (dict): The fields to fetch; _id is always fetched.
+        - mode (str): "change_stream", "poll", or "auto" to poll only when change streams
+          are not available.
+        - poll_interval (float): How often the result is reloaded in "poll" mode, in seconds.
+        - max_batch (int): The most changed documents fetched at once.
+        """
+        if mode not in ("auto", "change_stream", "poll"):
+            raise ValueError(
+                f"Unknown mode '{mode}', expected 'auto', 'change_stream' or 'poll'"
+            )
+        if projection and projection.get("_id") in (0, False):
+            raise ValueError("A LiveFrame needs the _id field, it cannot be projected out")
+
+        self.connection = connection
+        self.filter = filter or {}
+        self.projection = projection
+        self.poll_interval = poll_interval
+        self.max_batch = max_batch
+        self.mode = mode
+        self.closed = False
+
+        self._frame = None
+        # the connection's write generation the frame is known to include
+        self._synced_generation = -1
+        self._condition = threading.Condition()
+        self._stop = threading.Event()
+
+        # the stream is opened before the first load so no change is missed in between
+        stream = None
+        if mode != "poll":
+            try:
+                stream = self._open_stream()
+                self.mode = "change_stream"
+            except pymongo.errors.PyMongoError as e:
+                if mode == "change_stream":
+                    raise
+                _LOGGER.info("Change streams are not available, polling instead: %s", e)
+                self.mode = "poll"
+
+        self._reload()
+
+        self._thread = threading.Thread(
+            target=self._tail if stream is not None else self._poll,
+            args=(stream,) if stream is not None else (),
+            name="mongodb-connection-live-frame",
+            daemon=True,
+        )
+        self._thread.start()
+
+    def _generation(self) -> int:
+        return self.connection._generation()[1]
+
+    def _open_stream(self):
+        return self.connection._instance.watch(max_await_time_ms=200)
+
+    def _set_frame(self, frame: pd.DataFrame, generation: int):
+        with self._condition:
+            self._frame = _freeze_result(frame)
+            self._synced_generation = max(self._synced_generation, generation)
+            self._condition.notify_all()
+
+    def _reload(self):
+        """Replace the frame with a fresh result of the query."""
+        generation = self._generation()
+        documents = list(self.connection._instance.find(self.filter, self.projection))
+        frame = pd.DataFrame(documents)
+        frame = frame.set_index("_id") if "_id" in frame else frame.rename_axis("_id")
+        self._set_frame(frame, generation)
+
+    def _apply(self, ids: set, generation: int):
+        """Fetch the documents with the given _ids again and update their rows."""
+        query = {"$and": [self.filter, {"_id": {"$in": list(ids)}}]}
+        documents = list(self.connection._instance.find(query, self.projection))
+
+        frame = self._frame
+        found = {document["_id"] for document in documents}
+        removed = [_id for _id in ids if _id not in found and _id in frame.index]
+        if removed:
+            frame = frame.drop(index=removed)
+
+        if documents:
+            changed = pd.DataFrame(documents).set_index("_id")
+            # the changed rows are replaced whole by concat, which takes new columns and
+            # dtypes in, then put back in place; the frames returned by earlier reads are
+            # left unchanged
+            order = frame.index.append(changed.index[~changed.index.isin(frame.index)])
+            frame = pd.concat([frame.drop(index=changed.index, errors="ignore"), changed])
+            frame = frame.reindex(order)
+
+        self._set_frame(frame, generation)
+
+    def _tail(self, stream):
+        """Apply the changes of the collection's change stream in batches."""
+        try:
+            while not self._stop.is_set():
+                with stream:
+                    ids = set()
+                    while not self._stop.is_set():
+                        generation = self._generation()
+                        change = stream.try_next()
+                        if change is not None and change["operationType"] in self._RELOAD_EVENTS:
+                            break
+                        if change is not None:
+                            ids.add(change["documentKey"]["_id"])
+                            if len(ids) < self.max_batch:
+                                continue
+                        # the stream has no more changes for now: the frame is up to date
+                        if ids:
+                            try:
+                                self._apply(ids, generation)
+                            except Exception as e:
+                                _LOGGER.warning(
+                                    "Applying changes to a LiveFrame failed, reloading it: %s", e
+                                )
+                                self._reload()
+                            ids = set()
+                        else:
+                            self._set_frame(self._frame, generation)
+                if not self._stop.is_set():
+                    stream = self._open_stream()
+                    self._reload()
+        except Exception as e:
+            # the thread must not end silently: frame() would wait for it after every write
+            if self._stop.is_set():
+                return
+            _LOGGER.warning("Change stream of a LiveFrame stopped, polling instead: %s", e)
+            self.mode = "poll"
+            self._poll()
+
+    def _poll(self):
+        while not self._stop.wait(self.poll_interval):
+            try:
+                self._reload()
+            except Exception as e:
+                _LOGGER.warning("Reloading a LiveFrame failed: %s", e)
+
+    def frame(self, timeout: float = 1.0) -> pd.DataFrame:
+        """
+        Return the current result, indexed by _id.
+
+        After a write made through the connection, waits up to timeout seconds for the
+        write to reach the frame (in "poll" mode the result is reloaded right away).
+
+        Parameters:
+        - timeout (float): The longest wait for the connection's own writes, in seconds.
+
+        Returns:
+        pd.DataFrame: A read-only view of the result; modifying values in place raises ValueError.
+        """
+        generation = self._generation()
+        if self._synced_generation < generation:
+            if self.mode == "poll":
+                self._reload()
+            else:
+                with self._condition:
+                    self._condition.wait_for(
+                        lambda: self._synced_generation >= generation, timeout
+                    )
+        return _result_view(self._frame)
+
+    def close(self):
+        """Stop following the collection's changes."""
+        self.closed = True
+        self._stop.set()
+
+
+class _Histogram:
+    """Latency histogram with Prometheus-style cumulative buckets and recent samples for quantiles."""
+
+    BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, float("inf"))
+
+    def __init__(self):
+        self.counts = [0] * len(self.BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+        self.samples = collections.deque(maxlen=1000)
+
+    def observe(self, seconds: float):
+        for i, bound in enumerate(self.BUCKETS):
+            if seconds <= bound:
+                self.counts[i] += 1
+                break
+        self.count += 1
+        self.sum += seconds
+        self.samples.append(seconds)
+
+    def summary(self) -> dict:
+        samples = sorted(self.samples)
+
+        def _quantile(q):
+            return samples[min(int(q * len(samples)), len(samples) - 1)] if samples else None
+
+        return {
+            "count": self.count,
+            "mean": self.sum / self.count if self.count else None,
+            "p50": _quantile(0.5),
+            "p95": _quantile(0.95),
+            "p99": _quantile(0.99),
+        }
+
+
+class _ConnectionMetrics:
+    """The measurements behind MongoDBConnection.stats(), shared by all collection handles."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.methods = collections.defaultdict(
+            lambda: {"errors": 0, "documents": 0, "bytes": 0, "latency": _Histogram()}
+        )
+        self.commands = collections.defaultdict(
+            lambda: {"failures": 0, "latency": _Histogram()}
+        )
+        self.checkout_wait = _Histogram()
+        self.slow_queries = collections.deque(maxlen=50)
+        self._checkout_started = threading.local()
+
+    def observe_call(self, method: str, seconds: float, failed: bool):
+        with self.lock:
+            self.methods[method]["latency"].observe(seconds)
+            if failed:
+                self.methods[method]["errors"] += 1
+
+    def observe_result(self, method: str, result):
+        """Count the documents and bytes of a result read from MongoDB (not from a cache)."""
+        if isinstance(result, tuple):
+            result = result[0]
+        documents = (
+            result.num_rows if isinstance(result, (pa.Table, pa.RecordBatch))
+            else len(result) if isinstance(result, (pd.DataFrame, list))
+            else 1
+        )
+        size = _result_size(result)
+        with self.lock:
+            self.methods[method]["documents"] += documents
+            self.methods[method]["bytes"] += size
+
+    def command_listener(self) -> pymongo.monitoring.CommandListener:
+        metrics = self
+
+        class _CommandListener(pymongo.monitoring.CommandListener):
+            def started(self, event):
+                pass
+
+            def succeeded(self, event):
+                with metrics.lock:
+                    metrics.commands[event.command_name]["latency"].observe(
+                        event.duration_micros / 1e6
+                    )
+
+            def failed(self, event):
+                with metrics.lock:
+                    command = metrics.commands[event.command_name]
+                    command["latency"].observe(event.duration_micros / 1e6)
+                    command["failures"] += 1
+
+        return _CommandListener()
+
+    def pool_listener(self) -> pymongo.monitoring.ConnectionPoolListener:
+        metrics = self
+        started = self._checkout_started
+
+        class _PoolListener(pymongo.monitoring.ConnectionPoolListener):
+            # check outs start and end on the thread running the operation
+            def connection_check_out_started(self, event):
+                started.time = time.perf_counter()
+
+            def connection_checked_out(self, event):
+                self._observe()
+
+            def connection_check_out_failed(self, event):
+                self._observe()
+
+            def _observe(self):
+                start = getattr(started, "time", None)
+                if start is not None:
+                    with metrics.lock:
+                        metrics.checkout_wait.observe(time.perf_counter() - start)
+                    started.time = None
+
+            def pool_created(self, event):
+                pass
+
+            def pool_ready(self, event):
+                pass
+
+            def pool_cleared(self, event):
+                pass
+
+            def pool_closed(self, event):
+                pass
+
+            def connection_created(self, event):
+                pass
+
+            def connection_ready(self, event):
+                pass
+
+            def connection_closed(self, event):
+                pass
+
+            def connection_checked_in(self, event):
+                pass
+
+        return _PoolListener()
+
+
+def _instrumented(method):
+    """Record the latency and failures of a connection method in the connection's metrics."""
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        start = time.perf_counter()
+        failed = True
+        try:
+            result = method(self, *args, **kwargs)
+            failed = False
+            return result
+        finally:
+            end = time.perf_counter()
+            self._metrics.observe_call(method.__name__, end - start, failed)
+            startup = self._startup
+            if not failed and "first_call_seconds" not in startup:
+                startup["first_call_seconds"] = end - startup["created_at"]
+
+    return wrapper
+
+
+class MongoDBConnection(ExperimentalBaseConnection["pymongo.MongoClient"]):
+    """Basic st.experimental_connection implementation for MongoDB using pymongo"""
+
+    def __init__(self, connection_name: str, **kwargs) -> None:
+        # cold start timings, see stats()
+        self._startup = {"created_at": time.perf_counter(), "import_seconds": _IMPORT_SECONDS}
+        self._connection_state = "connecting"
+        self._ready_timeout = 10.0
+
+        # handles to other collections share this connection's client, pool and caches
+        self._root = self
+        self._collection_path = None
+        self._collections = {}
+        self._collections_lock = threading.Lock()
+
+        # background work (prefetching, gather, async methods) runs on a pool created on first use
+        self._executor = None
+        self._executor_lock = threading.Lock()
+
+        # per-collection write generations, folded into every cache key
+        self._generations = {}
+        self._generations_lock = threading.Lock()
+        self._change_watcher = None
+
+        # the result cache, None when reads are cached with st.cache_data
+        self._cache_backend = None
+        self._result_cache = None
+        self._disk_cache = None
+
+        # documents looked up by key, see get_many()
+        self._document_cache = None
+
+        # reads currently running, shared by concurrent identical callers
+        self._inflight = {}
+        self._inflight_lock = threading.Lock()
+
+        # per-method cache hit/miss counters
+        self._cache_stats = {}
+        self._cache_stats_lock = threading.Lock()
+
+        # latencies, result sizes and slow queries, see stats()
+        self._metrics = _ConnectionMetrics()
+        self._slow_query_seconds = 0.5
+
+        # query shapes seen by the connection with their plans, see index_report()
+        self._query_shapes = {}
+        self._query_shapes_lock = threading.Lock()
+        self._collscan_guard = "off"
+        self._collscan_min_documents = 100_000
+
+        # query guard limits applied to reads, see _read_options()
+        self._max_time_ms = 30_000
+        self._max_time_ms_explicit = False
+        self._max_rows = None
+        self._max_bytes = None
+
+        # reads made by Streamlit script runs, cancelled when the run is abandoned
+        self._cancel_abandoned_reads = True
+        self._guarded_reads = {}
+        self._cancelled_reads = set()
+        self._guarded_reads_lock = threading.Lock()
+        self._guarded_reads_pending = threading.Event()
+        self._read_ids = itertools.count()
+        self._read_tags = threading.local()
+        self._read_watchdog = None
+
+        # results kept up to date from change streams, least recently read first, see
+        # watch_frame()
+        self._live_frames = collections.OrderedDict()
+        self._live_frames_max = 16
+        self._live_frames_lock = threading.Lock()
+
+        # DuckDB database holding collection snapshots, opened on first use
+        self._duckdb_path = ":memory:"
+        self._duckdb = None
+        self._duckdb_lock = threading.Lock()
+
+        super().__init__(connection_name, **kwargs)
+
+    def _connect(self, **kwargs) -> pymongo.MongoClient:
+        """
+        Connect to the MongoDB database using the given connection parameters.
+
+        Parameters:
+        - connection_string (str): The MongoDB connection string.
+        - database (str): The name of the database to connect to.
+        - collection_name (str): The name of the collection to connect to.
+        - watch_changes (bool): Invalidate cached reads on writes made by other processes,
+          using a change stream on the database (requires a replica set; default: False).
+        - live_frames_max (int): The most results watch_frame keeps up to date (default: 16);
+          the least recently read is closed beyond it.
+        - cache (str | object): Where reads are cached: "streamlit" for st.cache_data (default),
+          "memory" for an in-process ResultCache, "none" to disable caching, or a cache object
+          with the ResultCache get/set/clear methods.
+        - cache_max_bytes (int): The memory budget of the "memory" cache, in bytes.
+        - cache_stale_ttl (float): How long expired results of the "memory" cache are still
+          served while a single background query refreshes them, in seconds (default: 0).
+        - cache_dir (str): A directory where the "memory" cache also keeps results, so they
+          survive restarts and are shared by the app's processes (default: None). Writes
+          through any of these processes invalidate the results for all of them; use
+          watch_changes for writes made by other programs.
+        - cache_disk_max_bytes (int): The disk budget of cache_dir, in bytes.
+        - document_cache_size (int): The most documents get_many caches per collection.
+        - duckdb_path (str): The DuckDB database file holding snapshots (default: in memory).
+        - slow_query_ms (float): Reads taking longer are explained and listed in stats()
+          (default: 500).
+        - indexes (list): Index specs created on the collection if missing, see ensure_indexes.
+        - collscan_guard (str): What to do with a query whose plan scans the whole collection:
+          "off" (default), "warn" to log a warning, or "refuse" to raise a ValueError. Queries
+          without a filter or sort are not checked.
+        - collscan_min_documents (int): Collections with fewer documents are not guarded.
+        - maxPoolSize, minPoolSize, maxIdleTimeMS: Connection pool options, also read from the
+          secrets. minPoolSize connections are opened before the first query.
+        - connect_in_background (bool): Return at once and set the client up (DNS, TLS, server
+          selection, pool warm up, indexes) on a background thread; see connection_state.
+          The first query waits for it for up to ready_timeout seconds (default: False); the
+          query after a failed setup starts a new one.
+        - ready_timeout (float): The longest wait of a query for a background connect, in seconds.
+        - max_time_ms (int): The server time limit of every read, in milliseconds (default:
+          30000, except for reads of the whole collection; None for no limit). Reads returning
+          rows return those read so far when it runs out, flagged as truncated (see
+          truncated()) and not cached.
+        - max_rows (int): The most rows a read returns (default: None); the result is cut and
+          flagged as truncated beyond it. Reads may also pass max_rows to override it.
+        - max_bytes (int): The most BSON bytes a read returns (default: None), like max_rows.
+        - cancel_abandoned_reads (bool): Kill the server operations of reads whose Streamlit
+          run is abandoned by a rerun or a stop, instead of waiting for them (default: True).
+        - **kwargs: Additional keyword arguments to pass to pymongo.MongoClient.
+
+        Returns:
+        pymongo.MongoClient: The MongoDB client connected to the specified database and collection.
+        """
+
+        if "connection_string" in kwargs:
+            connection_string = kwargs.pop("connection_string")
+        else:
+            connection_string = self._secrets["connection_string"]
+
+        if "database" in kwargs:
+            database = kwargs.pop("database")
+        else:
+            database = self._secrets["database"]
+
+        if "collection_name" in kwargs:
+            collection_name = kwargs.pop("collection_name")
+        else:
+            collection_name = self._secrets["collection_name"]
+
+        watch_changes = kwargs.pop(
+            "watch_changes", self._secrets.get("watch_changes", False)
+        )
+        self._live_frames_max = kwargs.pop(
+            "live_frames_max", self._secrets.get("live_frames_max", 16)
+        )
+        if not isinstance(self._live_frames_max, int) or self._live_frames_max <= 0:
+            raise ValueError(
+                f"live_frames_max must be a positive integer, got {self._live_frames_max!r}"
+            )
+
+        self._duckdb_path = kwargs.pop(
+            "duckdb_path", self._secrets.get("duckdb_path", ":memory:")
+        )
+
+        cache = kwargs.pop("cache", self._secrets.get("cache", "streamlit"))
+        cache_max_bytes = kwargs.pop(
+            "cache_max_bytes", self._secrets.get("cache_max_bytes", 256 * 1024 * 1024)
+        )
+        cache_stale_ttl = kwargs.pop(
+            "cache_stale_ttl", self._secrets.get("cache_stale_ttl", 0)
+        )
+        cache_dir = kwargs.pop("cache_dir", self._secrets.get("cache_dir"))
+        cache_disk_max_bytes = kwargs.pop(
+            "cache_disk_max_bytes",
+            self._secrets.get("cache_disk_max_bytes", 1024 * 1024 * 1024),
+        )
+        document_cache_size = kwargs.pop(
+            "document_cache_size", self._secrets.get("document_cache_size", 100_000)
+        )
+        if self._document_cache is None:
+            self._document_cache = DocumentCache(document_cache_size)
+
+        # a reconnect keeps the cached results
+        if self._cache_backend is None:
+            self._cache_backend = cache if isinstance(cache, str) else "custom"
+            if cache == "memory":
+                if cache_dir:
+                    self._disk_cache = DiskCache(cache_dir, cache_disk_max_bytes)
+                self._result_cache = ResultCache(
+                    cache_max_bytes, cache_stale_ttl, self._disk_cache
+                )
+            elif not isinstance(cache, str):
+                self._result_cache = cache
+            elif cache not in ("streamlit", "none"):
+                raise ValueError(
+                    f"Unknown cache '{cache}', expected 'streamlit', 'memory' or 'none'"
+                )
+
+        self._slow_query_seconds = (
+            kwargs.pop("slow_query_ms", self._secrets.get("slow_query_ms", 500)) / 1000
+        )
+
+        indexes = kwargs.pop("indexes", self._secrets.get("indexes"))
+        self._collscan_guard = kwargs.pop(
+            "collscan_guard", self._secrets.get("collscan_guard", "off")
+        )
+        if self._collscan_guard not in ("off", "warn", "refuse"):
+            raise ValueError(
+                f"Unknown collscan_guard '{self._collscan_guard}', expected 'off', 'warn' or 'refuse'"
+            )
+        self._collscan_min_documents = kwargs.pop(
+            "collscan_min_documents",
+            self._secrets.get("collscan_min_documents", 100_000),
+        )
+
+        # without an explicit limit, reads of the whole collection are left unlimited
+        self._max_time_ms_explicit = "max_time_ms" in kwargs or "max_time_ms" in self._secrets
+        self._max_time_ms = kwargs.pop(
+            "max_time_ms", self._secrets.get("max_time_ms", 30_000)
+        )
+        self._max_rows = kwargs.pop("max_rows", self._secrets.get("max_rows"))
+        self._max_bytes = kwargs.pop("max_bytes", self._secrets.get("max_bytes"))
+        for option, value in (
+            ("max_time_ms", self._max_time_ms),
+            ("max_rows", self._max_rows),
+            ("max_bytes", self._max_bytes),
+        ):
+            if value is not None and (not isinstance(value, int) or value <= 0):
+                raise ValueError(f"{option} must be a positive integer or None, got {value!r}")
+        self._cancel_abandoned_reads = kwargs.pop(
+            "cancel_abandoned_reads", self._secrets.get("cancel_abandoned_reads", True)
+        )
+
+        for option in ("maxPoolSize", "minPoolSize", "maxIdleTimeMS"):
+            if option not in kwargs and option in self._secrets:
+                kwargs[option] = self._secrets[option]
+
+        connect_in_background = kwargs.pop(
+            "connect_in_background", self._secrets.get("connect_in_background", False)
+        )
+        self._ready_timeout = kwargs.pop(
+            "ready_timeout", self._secrets.get("ready_timeout", 10.0)
+        )
+
+        def _open():
+            # the command and pool listeners feed stats()
+            kwargs["event_listeners"] = list(kwargs.get("event_listeners", [])) + [
+                self._metrics.command_listener(),
+                self._metrics.pool_listener(),
+            ]
+
+            client = pymongo.MongoClient(connection_string, **kwargs)
+            self.client = client
+            collection = client[database][collection_name]
+
+            # in the background, ready means MongoDB has answered
+            if connect_in_background:
+                try:
+                    client.admin.command("ping")
+                except BaseException:
+                    # the next attempt opens a client of its own
+                    client.close()
+                    raise
+
+            if kwargs.get("minPoolSize"):
+                self._warm_up(client, kwargs["minPoolSize"])
+
+            if indexes:
+                try:
+                    created = _ensure_indexes(collection, indexes)
+                    if created:
+                        _LOGGER.info("Created indexes %s on %s", created, collection.full_name)
+                except pymongo.errors.PyMongoError as e:
+                    _LOGGER.warning(
+                        "Creating the indexes of %s failed: %s", collection.full_name, e
+                    )
+
+            if watch_changes and not (
+                self._change_watcher and self._change_watcher.is_alive()
+            ):
+                self._change_watcher = threading.Thread(
+                    target=self._watch_changes,
+                    args=(collection.database,),
+                    name="mongodb-connection-change-watcher",
+                    daemon=True,
+                )
+                self._change_watcher.start()
+
+            self._connection_state = "ready"
+            self._startup["ready_seconds"] = time.perf_counter() - self._startup["created_at"]
+            return collection
+
+        self._connection_state = "connecting"
+        start = time.perf_counter()
+        try:
+            if not connect_in_background:
+                try:
+                    return _open()
+                except Exception:
+                    self._connection_state = "degraded"
+                    raise
+
+            # queries wait for this future in _instance, with a timeout
+            ready = concurrent.futures.Future()
+
+            def _open_in_background():
+                try:
+                    ready.set_result(_open())
+                except BaseException as e:
+                    self._connection_state = "degraded"
+                    _LOGGER.warning("Connecting to MongoDB failed: %s", e)
+                    ready.set_exception(e)
+
+            threading.Thread(
+                target=_open_in_background, name="mongodb-connection-connect", daemon=True
+            ).start()
+            return ready
+        finally:
+            self._startup["connect_seconds"] = time.perf_counter() - start
+
+    @staticmethod
+    def _warm_up(client: pymongo.MongoClient, connections: int):
+        """Open pooled connections ahead of the first queries by running concurrent pings."""
+        with concurrent.futures.ThreadPoolExecutor(max_workers=connections) as executor:
+            pings = [
+                executor.submit(client.admin.command, "ping") for _ in range(connections)
+            ]
+        for ping in pings:
+            if ping.exception() is not None:
+                _LOGGER.warning("Warming up the connection pool failed: %s", ping.exception())
+                break
+
+    @property
+    def _instance(self):
+        """The collection this handle reads and writes, see collection()."""
+        if self._collection_path is None:
+            instance = super()._instance
+            if isinstance(instance, concurrent.futures.Future):
+                instance = self._wait_until_ready(instance)
+            return instance
+
+        database, collection_name = self._collection_path
+        return self._root._instance.database.client[database][collection_name]
+
+    def _wait_until_ready(self, ready: concurrent.futures.Future):
+        """
+        Wait for a background connect to finish, for at most ready_timeout seconds.
+
+        A connect still running after the timeout is waited for again by the next call. A
+        failed one is dropped, so the next call starts a new attempt and the connection can
+        recover once MongoDB is reachable.
+        """
+        try:
+            collection = ready.result(timeout=self._ready_timeout)
+        except concurrent.futures.TimeoutError:
+            self._connection_state = "degraded"
+            raise pymongo.errors.ServerSelectionTimeoutError(
+                f"MongoDB was not ready within {self._ready_timeout} seconds"
+            ) from None
+        except Exception:
+            if self._raw_instance is ready:
+                self._raw_instance = None
+            raise
+
+        # later calls use the collection directly
+        if self._raw_instance is ready:
+            self._raw_instance = collection
+        return collection
+
+    @property
+    def connection_state(self) -> str:
+        """
+        The state of the connection to MongoDB, for pages to render accordingly.
+
+        "connecting" while the client is set up in the background (see connect_in_background),
+        "ready" once it is set up, and "degraded" when the setup failed or timed out, or when
+        the client currently cannot reach a server it knows of.
+        """
+        root = self._root
+        state = root._connection_state
+        if state == "ready":
+            servers = root.client.topology_description.server_descriptions().values()
+            if any(server.error is not None for server in servers):
+                return "degraded"
+        return state
+
+    def collection(self, name: str, database: str = None) -> "MongoDBConnection":
+        """
+        Return a handle on another collection sharing this connection's client.
+
+        The handle has all the methods of the connection. It uses the same connection pool,
+        worker pool and result cache, with cache entries kept apart per collection.
+
+        Parameters:
+        - name (str): The name of the collection.
+        - database (str): The name of its database (default: the connection's database).
+
+        Returns:
+        MongoDBConnection: The handle, the same object for every call with the same names.
+        """
+        database = database or self._root._instance.database.name
+
+        with self._root._collections_lock:
+            handle = self._root._collections.get((database, name))
+            if handle is None:
+                handle = copy.copy(self._root)
+                handle._collection_path = (database, name)
+                self._root._collections[(database, name)] = handle
+
+        return handle
+
+    def _generation(self) -> tuple:
+        """
+        Return the cache generation of the collection: its namespace and write counter.
+
+        Cached reads take it as an argument, so a write, which bumps the counter, makes the
+        next read of every cached method miss once while other collections keep their entries.
+        """
+        namespace = self._instance.full_name
+        return namespace, self._generations.get(namespace, 0)
+
+    def _bump_generation(self, namespace: str = None, documents: bool = True):
+        """
+        Invalidate the cached reads of a collection by bumping its write counter.
+
+        The documents cached by get_many are evicted too, unless documents is False for
+        writes that keep the document cache up to date themselves.
+        """
+        namespace = namespace or self._instance.full_name
+        with self._generations_lock:
+            self._generations[namespace] = self._generations.get(namespace, 0) + 1
+        if self._root._disk_cache is not None:
+            self._root._disk_cache.bump(namespace)
+        if documents:
+            self._root._document_cache.clear(namespace)
+
+    def _cached(self, method: str, ttl: int, compute, filter: dict = None, **options):
+        """
+        Return the cached result of a read, computing it on a miss.
+
+        The cache key is the fingerprint of the read (see _fingerprint) together with the
+        collection's generation, so reads differing in any option never share an entry.
+        Results come from the connection's ResultCache when one is configured, and from
+        st.cache_data otherwise.
+
+        Concurrent identical reads that miss are coalesced: one query is sent and the other
+        callers wait for its result (st.cache_data does the same with a lock per entry).
+        Results cut by the server time limit (see truncated()) are returned but not cached.
+
+        Parameters:
+        - method (str): The name of the connection method performing the read.
+        - ttl (int): Time-to-live for caching the result, in seconds.
+        - compute (callable): Performs the read when it is not cached.
+        - filter (dict): The query filter.
+        - **options: The other arguments that change the result.
+
+        Returns:
+        The result of compute, possibly from the cache.
+        """
+        generation = self._generation()
+        if self._root._disk_cache is not None:
+            # the write counter is per process, so processes sharing cache_dir key their
+            # results by the generation token they share on disk instead
+            generation = (generation[0], self._root._disk_cache.generation(generation[0]))
+
+        # results cut by the connection's limits differ from those of other connections
+        fingerprint = _fingerprint(
+            method,
+            filter,
+            generation=generation,
+            limits=[self._max_time_ms, self._max_rows, self._max_bytes],
+            **options,
+        )
+
+        computed = False
+
+        def _load(fingerprint: str):
+            nonlocal computed
+            computed = True
+
+            if method in self._QUERY_SHAPE_METHODS:
+                self._observe_query(method, filter, options)
+
+            start = time.perf_counter()
+            with self._guarded_read():
+                result = compute()
+            seconds = time.perf_counter() - start
+
+            self._metrics.observe_result(method, result)
+            if seconds >= self._slow_query_seconds:
+                self._submit(self._explain_slow_query, method, seconds, filter, options)
+
+            return result
+
+        def _refresh():
+            # the result may have been cached while this caller waited for another query
+            entry = self._result_cache.get(fingerprint)
+            if entry is not None and entry.expires_at > time.monotonic():
+                return entry.value
+
+            value = _load(fingerprint)
+            # a read cut by its time limit may be complete on the next run
+            if truncated(value) != "max_time_ms":
+                self._result_cache.set(fingerprint, _freeze_result(value), ttl)
+            return value
+
+        if self._cache_backend == "none":
+            result = _result_view(self._single_flight(fingerprint, lambda: _load(fingerprint)))
+        elif self._result_cache is not None:
+            entry = self._result_cache.get(fingerprint)
+            if entry is None:
+                result = self._single_flight(fingerprint, _refresh)
+            else:
+                result = entry.value
+                # a stale entry is served while a single background query refreshes it
+                if entry.expires_at <= time.monotonic():
+                    self._revalidate(fingerprint, _refresh)
+            result = _result_view(result)
+        else:
+            # each method and ttl gets its own cache_data cache: Streamlit identifies caches
+            # by qualified name and clears a cache when it is used with another ttl
+            def _load_cached(fingerprint: str):
+                result = _load(fingerprint)
+                if truncated(result) == "max_time_ms":
+                    raise _UncachedResult(result)
+                return result
+
+            _load_cached.__qualname__ = f"{type(self).__qualname__}.{method}.<ttl={ttl}>"
+            try:
+                result = cache_data(ttl=ttl)(_load_cached)(fingerprint)
+            except _UncachedResult as e:
+                result = e.result
+
+        with self._cache_stats_lock:
+            stats = self._cache_stats.setdefault(method, {"hits": 0, "misses": 0})
+            stats["misses" if computed else "hits"] += 1
+
+        return result
+
+    # the reads whose filter and sort are recorded as query shapes
+    _QUERY_SHAPE_METHODS = (
+        "find",
+        "find_one",
+        "get_many",
+        "query",
+        "count_documents",
+        "distinct_values",
+        "paginate_documents",
+        "paginate_keyset",
+    )
+
+    def _observe_query(self, method: str, filter: dict, options: dict):
+        """
+        Record the shape of a query sent to the server and apply the COLLSCAN guard to it.
+
+        The plan of each shape is explained once, when the guard is on or by index_report.
+        """
+        sort = options.get("sort")
+        if sort is None and "sort_key" in options:
+            sort = [(options["sort_key"], options.get("direction", pymongo.ASCENDING))]
+        sort = _sort_pairs(sort)
+        namespace = self._instance.full_name
+        shape = json_util.dumps({"filter": _query_shape(filter or {}), "sort": sort})
+
+        root = self._root
+        with root._query_shapes_lock:
+            entry = root._query_shapes.setdefault(
+                (namespace, shape),
+                {
+                    "namespace": namespace,
+                    "shape": shape,
+                    "methods": set(),
+                    "executions": 0,
+                    "connection": self,
+                    "filter": filter or {},
+                    "options": {**options, "sort": sort},
+                    "plan": None,
+                },
+            )
+            entry["methods"].add(method)
+            entry["executions"] += 1
+
+        # a query without a filter or a sort reads the whole collection by design
+        if root._collscan_guard == "off" or not (filter or sort):
+            return
+
+        if entry["plan"] is None:
+            entry["plan"] = self._plan_summary(entry)
+        if not entry["plan"]["collscan"]:
+            return
+
+        documents = self._instance.estimated_document_count()
+        if documents < root._collscan_min_documents:
+            return
+
+        message = (
+            f"{method} on {namespace} scans all {documents} documents for the query shape "
+            f"{shape}; an index on {_suggest_index(filter, sort)} would serve it"
+        )
+        if root._collscan_guard == "refuse":
+            raise ValueError(message)
+        _LOGGER.warning(message)
+
+    def _plan_summary(self, entry: dict) -> dict:
+        """Explain the query of a recorded shape and summarize the plan the server chooses."""
+        try:
+            plan = self._winning_plan(self._query_command(entry["filter"], entry["options"]))
+        except pymongo.errors.PyMongoError as e:
+            _LOGGER.warning("Explaining a query of %s failed: %s", entry["namespace"], e)
+            return {"stages": [], "collscan": False, "error": str(e)}
+
+        stages = _plan_stages(plan)
+        return {"stages": stages, "collscan": "COLLSCAN" in stages}
+
+    def index_report(self) -> pd.DataFrame:
+        """
+        Check the query shapes sent by the connection against the plans the server chooses.
+
+        Every filter and sort shape read by find, find_one, get_many, query,
+        count_documents, distinct_values and the paginate methods (of any collection handle) is explained
+        again, so the report reflects the current indexes.
+
+        Returns:
+        pd.DataFrame: One row per query shape, most executed first, with the methods that
+        sent it, the plan stages, whether an index serves it without a collection scan
+        or an in-memory sort (covered), and the keys of a suggested index otherwise.
+        """
+        root = self._root
+        with root._query_shapes_lock:
+            entries = list(root._query_shapes.values())
+
+        rows = []
+        for entry in entries:
+            entry["plan"] = entry["connection"]._plan_summary(entry)
+            stages = entry["plan"]["stages"]
+            sort = entry["options"]["sort"]
+            full_scan = not (entry["filter"] or sort)
+            covered = full_scan or not (
+                "COLLSCAN" in stages or "SORT" in stages or "error" in entry["plan"]
+            )
+            rows.append(
+                {
+                    "namespace": entry["namespace"],
+                    "shape": entry["shape"],
+                    "methods": sorted(entry["methods"]),
+                    "executions": entry["executions"],
+                    "plan": " > ".join(stages),
+                    "covered": covered,
+                    "suggested_index": None
+                    if covered
+                    else _suggest_index(entry["filter"], sort),
+                }
+            )
+
+        report = pd.DataFrame(
+            rows,
+            columns=[
+                "namespace",
+                "shape",
+                "methods",
+                "executions",
+                "plan",
+                "covered",
+                "suggested_index",
+            ],
+        )
+        return report.sort_values("executions", ascending=False, ignore_index=True)
+
+    def ensure_indexes(self, specs: list) -> list:
+        """
+        Create the indexes of the collection that are missing; existing ones are left as they are.
+
+        Index specs can also be declared in the secrets (or as the indexes argument of the
+        connection), and are then ensured at connect time.
+
+        Parameters:
+        - specs (list): Index specs, each a field name, a list of (field, direction) pairs,
+          or a dict with the "keys" and createIndexes options such as "name" or "unique".
+
+        Returns:
+        list: The names of the indexes created.
+        """
+        created = _ensure_indexes(self._instance, specs)
+
+        # plans chosen before the new indexes existed are explained again
+        root = self._root
+        with root._query_shapes_lock:
+            for entry in root._query_shapes.values():
+                entry["plan"] = None
+
+        return created
+
+    def _single_flight(self, fingerprint: str, load):
+        """
+        Run load once for all the callers asking for the same fingerprint at the same time.
+
+        Parameters:
+        - fingerprint (str): The fingerprint of the read.
+        - load (callable): Performs the read.
+
+        Returns:
+        The result of the single load call, shared by all callers.
+        """
+        with self._inflight_lock:
+            future = self._inflight.get(fingerprint)
+            leader = future is None
+            if leader:
+                future = concurrent.futures.Future()
+                self._inflight[fingerprint] = future
+
+        if not leader:
+            try:
+                return future.result()
+            except _ReadCancelled:
+                # the leader's run was abandoned, not this caller's
+                return load()
+
+        try:
+            result = load()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+        finally:
+            with self._inflight_lock:
+                del self._inflight[fingerprint]
+
+        return result
+
+    def _revalidate(self, fingerprint: str, refresh):
+        """Refresh a stale cache entry in the background unless a refresh is already running."""
+        with self._inflight_lock:
+            if fingerprint in self._inflight:
+                return
+
+        def _log_failure(future: concurrent.futures.Future):
+            if future.exception() is not None:
+                _LOGGER.warning("Refreshing a stale cached read failed: %s", future.exception())
+
+        self._submit(self._single_flight, fingerprint, refresh).add_done_callback(
+            _log_failure
+        )
+
+    def _read_options(self, options: dict, time_option: str = "max_time_ms") -> tuple:
+        """
+        Apply the query guard to the options of a read.
+
+        The connection's server time limit is added unless the read sets one, and reads of
+        a Streamlit run are tagged with a comment, so their server operations can be found
+        and killed if the run is abandoned (see _guarded_read).
+
+        Parameters:
+        - options (dict): The keyword arguments of the read, with max_rows and max_bytes.
+        - time_option (str): The name of the time limit option of the pymongo method,
+          "max_time_ms" for finds, "maxTimeMS" for aggregate, count_documents and distinct.
+
+        Returns:
+        tuple: The options for pymongo, and the max_rows and max_bytes limits.
+        """
+        options = dict(options)
+        max_rows = options.pop("max_rows", self._max_rows)
+        max_bytes = options.pop("max_bytes", self._max_bytes)
+        if self._max_time_ms is not None:
+            options.setdefault(time_option, self._max_time_ms)
+        tag = getattr(self._root._read_tags, "tag", None)
+        if tag is not None:
+            options.setdefault("comment", tag)
+        return options, max_rows, max_bytes
+
+    @contextlib.contextmanager
+    def _guarded_read(self):
+        """
+        Track a read made by a Streamlit script run, to cancel it if the run is abandoned.
+
+        The read's operations are tagged with a comment (see _read_options). A watchdog
+        thread kills them on the server when a rerun or a stop of the run is requested, and
+        the run is then stopped so the next one can start. Reads outside Streamlit, and
+        reads nested in a tracked read, are not tracked separately.
+        """
+        root = self._root
+        ctx = get_script_run_ctx(suppress_warning=True)
+        if (
+            ctx is None
+            or not self._cancel_abandoned_reads
+            or getattr(root._read_tags, "tag", None) is not None
+        ):
+            yield
+            return
+
+        tag = f"streamlit-mongodb:{ctx.session_id}:{next(root._read_ids)}"
+        with root._guarded_reads_lock:
+            root._guarded_reads[tag] = ctx
+            root._guarded_reads_pending.set()
+            if root._read_watchdog is None:
+                root._read_watchdog = threading.Thread(
+                    target=self._watch_abandoned_reads,
+                    name="mongodb-connection-read-watchdog",
+                    daemon=True,
+                )
+                root._read_watchdog.start()
+
+        root._read_tags.tag = tag
+        try:
+            yield
+        except pymongo.errors.PyMongoError as e:
+            if tag in root._cancelled_reads:
+                raise _ReadCancelled() from e
+            raise
+        finally:
+            root._read_tags.tag = None
+            with root._guarded_reads_lock:
+                del root._guarded_reads[tag]
+                root._cancelled_reads.discard(tag)
+
+    def _watch_abandoned_reads(self):
+        """Kill the server operations of tracked reads whose Streamlit run has been abandoned."""
+        root = self._root
+        while True:
+            root._guarded_reads_pending.wait()
+            time.sleep(0.2)
+
+            with root._guarded_reads_lock:
+                if not root._guarded_reads:
+                    root._guarded_reads_pending.clear()
+                    continue
+                abandoned = [
+                    tag
+                    for tag, ctx in root._guarded_reads.items()
+                    if tag not in root._cancelled_reads and _run_abandoned(ctx)
+                ]
+                root._cancelled_reads.update(abandoned)
+
+            if abandoned:
+                self._kill_reads(abandoned)
+
+    def _kill_reads(self, tags: list):
+        """Kill the server operations tagged with the given comments, see _guarded_read."""
+        admin = self._root.client.admin
+        try:
+            operations = admin.aggregate(
+                [
+                    {"$currentOp": {"allUsers": False}},
+                    {
+                        "$match": {
+                            "$or": [
+                                {"command.comment": {"$in": tags}},
+                                {"cursor.originatingCommand.comment": {"$in": tags}},
+                            ]
+                        }
+                    },
+                    {"$project": {"opid": 1}},
+                ]
+            )
+            for operation in operations:
+                admin.command("killOp", op=operation["opid"])
+                _LOGGER.info("Killed operation %s of an abandoned read", operation["opid"])
+        except pymongo.errors.PyMongoError as e:
+            _LOGGER.warning("Cancelling abandoned reads failed: %s", e)
+
+    def _query_command(self, filter: dict, options: dict) -> dict:
+        """Build the find (or aggregate) command a read sends, for explaining it."""
+        collection = self._instance
+        if "pipeline" in options:
+            return {"aggregate": collection.name, "pipeline": options["pipeline"], "cursor": {}}
+
+        command = {"find": collection.name, "filter": filter or {}}
+        for option in ("projection", "limit", "skip", "hint", "collation"):
+            if options.get(option) is not None:
+                command[option] = options[option]
+        sort = _sort_pairs(options.get("sort"))
+        if sort:
+            command["sort"] = bson.SON(sort)
+        return command
+
+    def _winning_plan(self, command: dict) -> dict:
+        """Return the plan the server chooses for a command, without running it."""
+        explain = self._instance.database.command("explain", command, verbosity="queryPlanner")
+        return explain.get("queryPlanner", {}).get("winningPlan", {})
+
+    def _explain_slow_query(self, method: str, seconds: float, filter: dict, options: dict):
+        """Record the query plan of a slow read, as chosen by the server, in the slow query log."""
+        collection = self._instance
+        command = self._query_command(filter, options)
+        try:
+            plan = self._winning_plan(command)
+        except pymongo.errors.PyMongoError as e:
+            plan = f"explain failed: {e}"
+
+        with self._metrics.lock:
+            self._metrics.slow_queries.append(
+                {
+                    "method": method,
+                    "namespace": collection.full_name,
+                    "seconds": seconds,
+                    "command": json_util.dumps(command),
+                    "plan": plan,
+                    "at": datetime.datetime.now(datetime.timezone.utc),
+                }
+            )
+
+    def stats(self) -> dict:
+        """
+        Return a snapshot of the connection's instrumentation.
+
+        Returns:
+        dict: With the keys
+        - "methods": per public method, calls, errors and latency quantiles in seconds,
+          and the documents and bytes read from MongoDB (cache hits excluded),
+        - "commands": per MongoDB command, latency quantiles and failures,
+        - "pool": the time spent waiting to check out a pooled connection,
+        - "cache": the hits and misses per cached method and the result cache usage,
+        - "slow_queries": the most recent slow reads with the plan chosen by the server,
+        - "startup": the connection_state and the cold start timings in seconds: importing
+          this module, connecting (the time _connect blocked), until the client was ready,
+          and until the first successful public method call returned, both counted from the
+          connection's creation.
+        """
+        metrics = self._metrics
+        with metrics.lock:
+            methods = {
+                name: {
+                    **method["latency"].summary(),
+                    "errors": method["errors"],
+                    "documents": method["documents"],
+                    "bytes": method["bytes"],
+                }
+                for name, method in metrics.methods.items()
+            }
+            commands = {
+                name: {**command["latency"].summary(), "failures": command["failures"]}
+                for name, command in metrics.commands.items()
+            }
+            pool = metrics.checkout_wait.summary()
+            slow_queries = list(metrics.slow_queries)
+
+        cache = {"methods": self.cache_stats()}
+        if self._result_cache is not None and hasattr(self._result_cache, "info"):
+            cache.update(self._result_cache.info())
+        cache["documents"] = self._root._document_cache.info()
+
+        startup = {"state": self.connection_state}
+        startup.update(
+            (name, value) for name, value in self._startup.items() if name != "created_at"
+        )
+
+        return {
+            "methods": methods,
+            "commands": commands,
+            "pool": pool,
+            "cache": cache,
+            "slow_queries": slow_queries,
+            "startup": startup,
+        }
+
+    def prometheus_metrics(self) -> str:
+        """
+        Export the connection's instrumentation in the Prometheus text format.
+
+        Returns:
+        str: The metrics, ready to be served on a /metrics endpoint.
+        """
+        lines = []
+
+        def _histogram(name: str, labels: str, histogram: _Histogram):
+            cumulative = 0
+            for bound, count in zip(histogram.BUCKETS, histogram.counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f'{name}_bucket{{{labels}le="{le}"}} {cumulative}')
+            lines.append(f"{name}_sum{{{labels.rstrip(',')}}} {histogram.sum}")
+            lines.append(f"{name}_count{{{labels.rstrip(',')}}} {histogram.count}")
+
+        metrics = self._metrics
+        with metrics.lock:
+            lines.append("# TYPE mongodb_connection_method_seconds histogram")
+            for name, method in metrics.methods.items():
+                _histogram("mongodb_connection_method_seconds", f'method="{name}",', method["latency"])
+            for metric in ("errors", "documents", "bytes"):
+                lines.append(f"# TYPE mongodb_connection_method_{metric}_total counter")
+                for name, method in metrics.methods.items():
+                    lines.append(
+                        f'mongodb_connection_method_{metric}_total{{method="{name}"}} {method[metric]}'
+                    )
+
+            lines.append("# TYPE mongodb_connection_command_seconds histogram")
+            for name, command in metrics.commands.items():
+                _histogram("mongodb_connection_command_seconds", f'command="{name}",', command["latency"])
+
+            lines.append("# TYPE mongodb_connection_pool_checkout_seconds histogram")
+            _histogram("mongodb_connection_pool_checkout_seconds", "", metrics.checkout_wait)
+
+        lines.append("# TYPE mongodb_connection_cache_total counter")
+        for name, counts in self.cache_stats().items():
+            for result, count in counts.items():
+                lines.append(
+                    f'mongodb_connection_cache_total{{method="{name}",result="{result}"}} {count}'
+                )
+
+        return "\n".join(lines) + "\n"
+
+    def debug_panel(self):
+        """Render the connection's instrumentation in a collapsed Streamlit expander."""
+        stats = self.stats()
+        with st.expander("MongoDB connection stats"):
+            st.subheader("Methods")
+            st.dataframe(pd.DataFrame.from_dict(stats["methods"], orient="index"))
+            st.subheader("Commands")
+            st.dataframe(pd.DataFrame.from_dict(stats["commands"], orient="index"))
+            st.subheader("Connection pool check out wait")
+            st.write(stats["pool"])
+            st.subheader("Cache")
+            st.write(stats["cache"])
+            st.subheader("Slow queries")
+            st.dataframe(pd.DataFrame(stats["slow_queries"]))
+            st.subheader("Startup")
+            st.write(stats["startup"])
+
+    def cache_stats(self) -> dict:
+        """
+        Return the cache hit and miss counts of each cached method.
+
+        Returns:
+        dict: Maps method names to {"hits": int, "misses": int}.
+        """
+        with self._cache_stats_lock:
+            return {method: dict(stats) for method, stats in self._cache_stats.items()}
+
+    def clear_cache(self):
+        """Remove all cached results of the connection's ResultCache and cached documents."""
+        if self._result_cache is not None:
+            self._result_cache.clear()
+        self._root._document_cache.clear()
+
+    def _watch_changes(self, database):
+        """Bump a collection's generation on every change to it, including other processes' writes."""
+        try:
+            with database.watch() as stream:
+                for change in stream:
+                    namespace = change.get("ns", {})
+                    if "coll" in namespace:
+                        self._bump_generation(f"{namespace['db']}.{namespace['coll']}")
+        except pymongo.errors.PyMongoError as e:
+            _LOGGER.warning(
+                "Change stream on %s stopped, cached reads are only invalidated by "
+                "this connection's writes: %s",
+                database.name,
+                e,
+            )
+
+    def _submit(self, fn, *args, **kwargs) -> concurrent.futures.Future:
+        """
+        Run a function on the connection's worker pool.
+
+        The Streamlit script run context of the caller is attached to the worker thread,
+        so cached functions called in the background behave as they do on the script thread.
+
+        Parameters:
+        - fn (callable): The function to run.
+        - *args, **kwargs: The arguments to call it with.
+
+        Returns:
+        concurrent.futures.Future: The future holding the function's result.
+        """
+
+        root = self._root
+        with root._executor_lock:
+            if root._executor is None:
+                root._executor = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=4, thread_name_prefix="mongodb-connection"
+                )
+
+        ctx = get_script_run_ctx()
+
+        def _run():
+            if ctx is not None:
+                add_script_run_ctx(threading.current_thread(), ctx)
+            return fn(*args, **kwargs)
+
+        return root._executor.submit(_run)
+
+    def gather(self, *calls) -> list:
+        """
+        Run independent reads concurrently and wait for all of them.
+
+        The calls run on the connection's worker pool, each on its own pooled connection, so
+        the time taken is that of the slowest read instead of the sum of all of them.
+
+        Parameters:
+        - *calls (callable): Functions taking no arguments, e.g.
+          lambda: conn.count_documents(query) or functools.partial(conn.find, query).
+
+        Returns:
+        list: The results of the calls, in the order they were given.
+        """
+        futures = [self._submit(call) for call in calls]
+        return [future.result() for future in futures]
+
+    async def _run_async(self, fn, *args, **kwargs):
+        """Await a blocking connection method run on the connection's worker pool."""
+        return await asyncio.wrap_future(self._submit(fn, *args, **kwargs))
+
+    async def ashow_all_documents(self, *args, **kwargs):
+        """Asynchronous show_all_documents; takes the same arguments."""
+        return await self._run_async(self.show_all_documents, *args, **kwargs)
+
+    async def afind(self, *args, **kwargs):
+        """Asynchronous find; takes the same arguments."""
+        return await self._run_async(self.find, *args, **kwargs)
+
+    async def afind_one(self, *args, **kwargs):
+        """Asynchronous find_one; takes the same arguments."""
+        return await self._run_async(self.find_one, *args, **kwargs)
+
+    async def aget_many(self, *args, **kwargs):
+        """Asynchronous get_many; takes the same arguments."""
+        return await self._run_async(self.get_many, *args, **kwargs)
+
+    async def acount_documents(self, *args, **kwargs):
+        """Asynchronous count_documents; takes the same arguments."""
+        return await self._run_async(self.count_documents, *args, **kwargs)
+
+    async def adistinct_values(self, *args, **kwargs):
+        """Asynchronous distinct_values; takes the same arguments."""
+        return await self._run_async(self.distinct_values, *args, **kwargs)
+
+    async def atop_values(self, *args, **kwargs):
+        """Asynchronous top_values; takes the same arguments."""
+        return await self._run_async(self.top_values, *args, **kwargs)
+
+    async def aaggregate(self, *args, **kwargs):
+        """Asynchronous aggregate; takes the same arguments."""
+        return await self._run_async(self.aggregate, *args, **kwargs)
+
+    async def aquery(self, *args, **kwargs):
+        """Asynchronous query; takes the same arguments."""
+        return await self._run_async(self.query, *args, **kwargs)
 
+    async def apaginate_documents(self, *args, **kwargs):
+        """Asynchronous paginate_documents; takes the same arguments."""
+        return await self._run_async(self.paginate_documents, *args, **kwargs)
 
-class MongoDBConnection(ExperimentalBaseConnection[pymongo.MongoClient]):
-    """Basic st.experimental_connection implementation for MongoDB using pymongo"""
+    async def apaginate_keyset(self, *args, **kwargs):
+        """Asynchronous paginate_keyset; takes the same arguments."""
+        return await self._run_async(self.paginate_keyset, *args, **kwargs)
 
-    def _connect(self, **kwargs) -> pymongo.MongoClient:
+    @_instrumented
+    def infer_schema(
+        self, filter: dict = None, sample_size: int = 1000, ttl: int = 3600
+    ) -> pa.Schema:
         """
-        Connect to the MongoDB database using the given connection parameters.
+        Infer a compact Arrow schema from a random sample of the collection's documents.
+
+        Subdocuments are flattened into dotted fields, low-cardinality strings become
+        dictionary (categorical) fields, ObjectIds 12-byte fixed binaries and datetimes
+        timestamps. Reads with result_format="compact" use this schema when none is declared,
+        and fetch only its fields; its types are widened where the documents read don't fit
+        them (see _widen_field), since the sample may not hold every kind of value. A
+        declared schema may map ObjectId fields to pa.string() to get them as hexadecimal
+        strings instead.
 
         Parameters:
-        - connection_string (str): The MongoDB connection string.
-        - database (str): The name of the database to connect to.
-        - collection_name (str): The name of the collection to connect to.
-        - **kwargs: Additional keyword arguments to pass to pymongo.MongoClient.
+        - filter (dict): Only sample the documents matching this filter (default: None).
+        - sample_size (int): The number of documents sampled with $sample.
+        - ttl (int): Time-to-live for caching the schema, in seconds.
 
         Returns:
-        pymongo.MongoClient: The MongoDB client connected to the specified database and collection.
+        pa.Schema: The inferred schema, empty if no document matches.
         """
 
-        if "connection_string" in kwargs:
-            connection_string = kwargs.pop("connection_string")
-        else:
-            connection_string = self._secrets["connection_string"]
+        def _infer_schema_from_sample():
+            pipeline = _match_stage(filter) + [{"$sample": {"size": sample_size}}]
+            options, _, _ = self._read_options({}, "maxTimeMS")
+            return _infer_schema(list(self._instance.aggregate(pipeline, **options)), compact=True)
 
-        if "database" in kwargs:
-            database = kwargs.pop("database")
-        else:
-            database = self._secrets["database"]
+        return self._cached(
+            "infer_schema", ttl, _infer_schema_from_sample, filter, sample_size=sample_size
+        )
 
-        if "collection_name" in kwargs:
-            collection_name = kwargs.pop("collection_name")
+    def _field_types(self, filter: dict = None) -> dict:
+        """
+        List the dotted field names of all the documents matching a filter, with their types.
+
+        Unlike infer_schema, every document is read, with one aggregation per level of
+        subdocuments: the server lists the keys of the documents, or of the subdocuments
+        found by the previous level, and only returns the distinct ones with their types.
+
+        Parameters:
+        - filter (dict): The filter to apply on the documents (default: None).
+
+        Returns:
+        dict: The field names, flattened as by infer_schema, and the set of the BSON type
+        names ($type) each one holds.
+        """
+        types, subdocuments = {}, set()
+        prefixes = [None]
+        while prefixes:
+            keys = []
+            for prefix in prefixes:
+                if prefix is None:
+                    source, name = "$$ROOT", "$$kv.k"
+                else:
+                    source = {
+                        "$cond": [{"$eq": [{"$type": f"${prefix}"}, "object"]}, f"${prefix}", {}]
+                    }
+                    name = {"$concat": [f"{prefix}.", "$$kv.k"]}
+                keys.append(
+                    {
+                        "$map": {
+                            "input": {"$objectToArray": source},
+                            "as": "kv",
+                            "in": {"name": name, "type": {"$type": "$$kv.v"}},
+                        }
+                    }
+                )
+            pipeline = _match_stage(filter) + [
+                {"$project": {"_id": 0, "key": {"$concatArrays": keys}}},
+                {"$unwind": "$key"},
+                {"$group": {"_id": "$key"}},
+            ]
+            found = [row["_id"] for row in self._instance.aggregate(pipeline)]
+
+            for key in found:
+                if key["type"] != "object":
+                    types.setdefault(key["name"], set()).add(key["type"])
+            prefixes = sorted({key["name"] for key in found if key["type"] == "object"})
+            subdocuments.update(prefixes)
+
+        # subdocuments without keys, only ever empty, are fields of their own as in
+        # _flatten_document
+        parents = {name.rsplit(".", 1)[0] for name in set(types) | subdocuments if "." in name}
+        for name in subdocuments - parents:
+            types.setdefault(name, set()).add("object")
+        return types
+
+    def _fetch(
+        self,
+        filter: dict,
+        result_format: str = "pandas",
+        schema: pa.Schema = None,
+        widen: bool = None,
+        **kwargs,
+    ):
+        """
+        Run a find on the collection and return the result in the requested format.
+
+        When a schema is given or inferred, only its fields are fetched from the server,
+        unless a projection is passed. The query guard limits apply (see _read_options): a
+        result cut at max_rows, max_bytes or max_time_ms is flagged as truncated.
+
+        Parameters:
+        - filter (dict): The filter to apply on the documents.
+        - result_format (str): "pandas" for a DataFrame, "arrow" for a pyarrow.Table,
+          "compact" for a DataFrame with compact dtypes.
+        - schema (pa.Schema): Arrow schema for the "arrow" and "compact" formats. The
+          "arrow" format infers it from the documents read, "compact" with infer_schema.
+        - widen (bool): Widen the schema's fields to the documents' values instead of
+          raising a ValueError (see _iter_record_batches); the default for inferred schemas.
+        - **kwargs: Additional keyword arguments to pass to pymongo.Collection.find, and
+          max_rows and max_bytes to override the connection's limits.
+
+        Returns:
+        pd.DataFrame | pa.Table: The matching documents.
+        """
+
+        if result_format not in ("pandas", "arrow", "compact"):
+            raise ValueError(
+                f"Unknown result_format '{result_format}', expected 'pandas', 'arrow' or 'compact'"
+            )
+
+        if widen is None:
+            # the types of a sampled schema only hold for the documents of the sample
+            widen = schema is None
+        if result_format == "compact" and schema is None:
+            schema = self.infer_schema(filter)
+        if schema is not None and len(schema) and "projection" not in kwargs:
+            kwargs["projection"] = _schema_projection(schema)
+
+        if not filter and not kwargs.get("limit") and not self._max_time_ms_explicit:
+            # a read of the whole collection takes as long as the collection is big
+            kwargs.setdefault("max_time_ms", None)
+        kwargs, max_rows, max_bytes = self._read_options(kwargs)
+        if max_rows is not None:
+            if kwargs.get("limit") and kwargs["limit"] <= max_rows:
+                max_rows = None
+            else:
+                # one extra document tells whether the result was cut
+                kwargs["limit"] = max_rows + 1
+
+        cut = {}
+        if result_format == "pandas":
+            documents = list(
+                _cap_documents(self._instance.find(filter, **kwargs), max_bytes, cut)
+            )
+            result = pd.DataFrame(_cap_rows(documents, max_rows, cut))
         else:
-            collection_name = self._secrets["collection_name"]
+            table = _raw_batches_to_table(
+                _cap_raw_batches(self._instance.find_raw_batches(filter, **kwargs), max_bytes, cut),
+                schema,
+                widen=widen,
+            )
+            table = _cap_rows(table, max_rows, cut)
+            result = _compact_frame(table) if result_format == "compact" else table
+
+        return _mark_truncated(result, cut.get("reason"))
+
+    @staticmethod
+    def to_pandas(table: pa.Table) -> pd.DataFrame:
+        """
+        Convert an Arrow result into a DataFrame without copying the column data.
+
+        The DataFrame columns are backed by the Arrow buffers (pd.ArrowDtype), so
+        ObjectId and datetime columns keep their binary and timestamp types.
 
-        client = pymongo.MongoClient(connection_string, **kwargs)
-        self.client = client
+        Parameters:
+        - table (pa.Table): A table returned with result_format="arrow".
 
-        return client[database][collection_name]
+        Returns:
+        pd.DataFrame: An Arrow-backed DataFrame sharing memory with the table.
+        """
+        return table.to_pandas(types_mapper=pd.ArrowDtype)
 
-    def show_all_documents(self, ttl: int = 1000, **kwargs):
+    @_instrumented
+    def show_all_documents(
+        self,
+        ttl: int = 1000,
+        result_format: str = "pandas",
+        schema: pa.Schema = None,
+        partitions: int = 1,
+        partition_key: str = "_id",
+        **kwargs,
+    ):
         """
         Retrieve all documents from the MongoDB collection.
 
+        With several partitions, the collection is split into ranges of partition_key and
+        the ranges are read concurrently, each by its own cursor, thread and pooled
+        connection, see _fetch_partitioned.
+
         Parameters:
         - ttl (int): Time-to-live for caching the result, in seconds.
-        - **kwargs: Additional keyword arguments to pass to pymongo.Collection.find.
+        - result_format (str): "pandas" for a DataFrame, "arrow" for a pyarrow.Table,
+          "compact" for a DataFrame with compact dtypes (see infer_schema).
+        - schema (pa.Schema): Arrow schema for the "arrow" and "compact" formats, inferred
+          if None; only its fields are fetched.
+        - partitions (int): The number of ranges read concurrently (default: 1).
+        - partition_key (str): The field the ranges are taken on, _id or a shard key, with
+          values of one BSON type for the ranges to be even (see _fetch_partitioned).
+        - **kwargs: Additional keyword arguments to pass to pymongo.Collection.find, and
+          max_rows and max_bytes to override the connection's limits.
 
         Returns:
-        pd.DataFrame: A DataFrame containing all the documents from the collection.
+        pd.DataFrame | pa.Table: All the documents from the collection, flagged as truncated
+        if cut by the query guard limits (see truncated()).
         """
 
-        @cache_data(ttl=ttl)
         def _find_all_documents():
-            return pd.DataFrame(list(self._instance.find(**kwargs)))
+            if partitions > 1:
+                return self._fetch_partitioned(
+                    {}, result_format, schema, partitions, partition_key, **kwargs
+                )
+            return self._fetch({}, result_format, schema, **kwargs)
+
+        return self._cached(
+            "show_all_documents",
+            ttl,
+            _find_all_documents,
+            result_format=result_format,
+            schema=schema,
+            partitions=partitions if partitions > 1 else None,
+            partition_key=partition_key if partitions > 1 else None,
+            **kwargs,
+        )
+
+    def _fetch_partitioned(
+        self,
+        filter: dict,
+        result_format: str,
+        schema: pa.Schema,
+        partitions: int,
+        partition_key: str,
+        **kwargs,
+    ):
+        """
+        Run a find as concurrent range queries on partition_key and concatenate their results.
+
+        The range boundaries are quantiles of the partition_key values of a $sample of the
+        matching documents. MongoDB only compares values of the same BSON type, so a last
+        range reads the documents no other range matches: those missing partition_key, with
+        a null, an array or a value of a type absent from the sample. A sample holding values
+        of several types is read with a single cursor; the check only sees the sample. The
+        sample also provides the schema of the "compact" format when none is given, so all
+        ranges decode to the same columns; with "arrow" each range infers its own, and the
+        tables are merged with the fields of all. Documents come ordered by range, and not in
+        the order of a single cursor.
+
+        Parameters:
+        - filter (dict): The filter to apply on the documents.
+        - result_format (str): "pandas", "arrow" or "compact", see _fetch.
+        - schema (pa.Schema): Arrow schema for the "arrow" and "compact" formats.
+        - partitions (int): The number of ranges.
+        - partition_key (str): The field the ranges are taken on.
+        - **kwargs: Additional keyword arguments to pass to pymongo.Collection.find, and
+          max_rows and max_bytes, which apply to the whole result.
+
+        Returns:
+        pd.DataFrame | pa.Table: The matching documents.
+        """
+        # oversampling evens out the sizes of the ranges
+        pipeline = _match_stage(filter) + [{"$sample": {"size": partitions * 32}}]
+        options, max_rows, max_bytes = self._read_options({}, "maxTimeMS")
+        sample = list(self._instance.aggregate(pipeline, **options))
+
+        keys = [_field_value(document, partition_key) for document in sample]
+        try:
+            keys = sorted(key for key in keys if key is not None)
+        except TypeError:
+            _LOGGER.warning("%s holds values of several types, reading with one cursor", partition_key)
+            keys = []
+        bounds = sorted({keys[len(keys) * i // partitions] for i in range(1, partitions)}) if keys else []
+        if not bounds:
+            return self._fetch(filter, result_format, schema, **kwargs)
+
+        # arrays match a range through any element, so they are left to the last range
+        not_array = {"$not": {"$type": "array"}}
+        ranges = [{partition_key: {"$lt": bounds[0], **not_array}}]
+        ranges += [
+            {partition_key: {"$gte": low, "$lt": high, **not_array}}
+            for low, high in zip(bounds, bounds[1:])
+        ]
+        ranges.append({partition_key: {"$gte": bounds[-1], **not_array}})
+        ranges.append({"$nor": list(ranges)})
+        filters = [{"$and": [filter, key_range]} if filter else key_range for key_range in ranges]
+
+        widen = schema is None
+        if result_format == "compact" and schema is None:
+            schema = _infer_schema(sample, compact=True)
+        part_format = "pandas" if result_format == "pandas" else "arrow"
+
+        if not filter and not kwargs.get("limit") and not self._max_time_ms_explicit:
+            # the ranges together read the whole collection, which has no time limit by
+            # default (see _fetch)
+            kwargs.setdefault("max_time_ms", None)
+
+        # the ranges share the limits, and the comment tagging this read
+        max_rows = kwargs.pop("max_rows", max_rows)
+        max_bytes = kwargs.pop("max_bytes", max_bytes)
+        kwargs["max_rows"] = max_rows
+        kwargs["max_bytes"] = max_bytes // len(filters) if max_bytes is not None else None
+        if "comment" in options:
+            kwargs.setdefault("comment", options["comment"])
+
+        # a pool per scan: waiting for the ranges on the shared pool could exhaust it
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=len(filters), thread_name_prefix="mongodb-connection-scan"
+        ) as executor:
+            parts = list(
+                executor.map(
+                    lambda part_filter: self._fetch(
+                        part_filter, part_format, schema, widen, **kwargs
+                    ),
+                    filters,
+                )
+            )
+
+        reasons = [truncated(part) for part in parts if truncated(part)]
+        cut = {"reason": reasons[0]} if reasons else {}
+        if result_format == "pandas":
+            result = pd.concat(parts, ignore_index=True)
+            if max_rows is not None and len(result) > max_rows:
+                result = result.iloc[:max_rows]
+                cut["reason"] = "max_rows"
+        else:
+            # ranges with an inferred schema may differ by the fields they hold and their types
+            schema = _unify_schemas([part.schema for part in parts])
+            table = pa.Table.from_batches(
+                [
+                    _widen_record_batch(record_batch, schema)
+                    for part in parts
+                    for record_batch in part.to_batches()
+                ],
+                schema=schema,
+            )
+            table = _cap_rows(table, max_rows, cut)
+            result = _compact_frame(table) if result_format == "compact" else table
+        return _mark_truncated(result, cut.get("reason"))
+
+    def iter_batches(
+        self,
+        filter: dict = None,
+        batch_size: int = 1000,
+        result_format: str = "pandas",
+        schema: pa.Schema = None,
+        **kwargs,
+    ):
+        """
+        Iterate over the documents matching a filter in bounded-size chunks.
+
+        Chunks are yielded as the server batches arrive, so the first rows are available
+        before the whole result has been downloaded and memory use does not grow with the
+        size of the collection. Results are not cached, nor limited by the connection's
+        max_time_ms, max_rows and max_bytes.
+
+        Parameters:
+        - filter (dict): The filter to apply on the documents (default: None).
+        - batch_size (int): The maximum number of documents per chunk.
+        - result_format (str): "pandas" for DataFrame chunks, "arrow" for pyarrow.RecordBatch chunks,
+          "compact" for DataFrame chunks with compact dtypes.
+        - schema (pa.Schema): Arrow schema for the "arrow" and "compact" formats, inferred if None
+          (from the first chunk for "arrow", later chunks adding the fields they first hold,
+          with infer_schema for "compact"); only its fields are fetched.
+        - **kwargs: Additional keyword arguments to pass to pymongo.Collection.find_raw_batches.
+
+        Yields:
+        pd.DataFrame | pa.RecordBatch: The next chunk of matching documents.
+        """
+
+        if result_format not in ("pandas", "arrow", "compact"):
+            raise ValueError(
+                f"Unknown result_format '{result_format}', expected 'pandas', 'arrow' or 'compact'"
+            )
+
+        widen = schema is None
+        if result_format == "compact" and schema is None:
+            schema = self.infer_schema(filter)
+        if schema is not None and len(schema) and "projection" not in kwargs:
+            kwargs["projection"] = _schema_projection(schema)
+
+        raw_batches = self._instance.find_raw_batches(
+            filter or {}, batch_size=batch_size, **kwargs
+        )
 
-        return _find_all_documents()
+        if result_format == "arrow":
+            yield from _iter_record_batches(raw_batches, schema)
+            return
+        if result_format == "compact":
+            for record_batch in _iter_record_batches(raw_batches, schema, True, widen):
+                yield _compact_frame(pa.Table.from_batches([record_batch]))
+            return
 
-    def find(self, filter: dict = None, ttl: int = 1000, **kwargs) -> pd.DataFrame:
+        for raw_batch in raw_batches:
+            documents = bson.decode_all(raw_batch)
+            if documents:
+                yield pd.DataFrame(documents)
+
+    @_instrumented
+    def find(
+        self,
+        filter: dict = None,
+        ttl: int = 1000,
+        result_format: str = "pandas",
+        schema: pa.Schema = None,
+        **kwargs,
+    ):
         """
         Find documents in the MongoDB collection that match the specified filter.
 
         Parameters:
         - filter (dict): The filter to apply on the documents (default: None).
         - ttl (int): Time-to-live for caching the result, in seconds.
-        - **kwargs: Additional keyword arguments to pass to pymongo.Collection.find.
+        - result_format (str): "pandas" for a DataFrame, "arrow" for a pyarrow.Table,
+          "compact" for a DataFrame with compact dtypes (see infer_schema).
+        - schema (pa.Schema): Arrow schema for the "arrow" and "compact" formats, inferred
+          if None; only its fields are fetched.
+        - **kwargs: Additional keyword arguments to pass to pymongo.Collection.find, and
+          max_rows and max_bytes to override the connection's limits.
 
         Returns:
-        pd.DataFrame: A DataFrame containing the documents that match the filter.
+        pd.DataFrame | pa.Table: The documents that match the filter, flagged as truncated
+        if cut by the query guard limits (see truncated()).
         """
 
-        @cache_data(ttl=ttl)
-        def _find(
-            filter: dict = None,
-        ):
-            query = filter or {}
+        # query options left unset (None) are not passed on to pymongo
+        options = {name: value for name, value in kwargs.items() if value is not None}
 
-            # Extract any additional query options from **kwargs
-            projection = kwargs.get("projection")
-            sort = kwargs.get("sort")
-            limit = kwargs.get("limit")
-            skip = kwargs.get("skip")
+        def _find():
+            query = filter or {}
 
             # Perform the find operation with additional query options
-            cursor = self._instance.find(
-                query, projection=projection, sort=sort, limit=limit, skip=skip
-            )
+            return self._fetch(query, result_format, schema, **options)
+
+        return self._cached(
+            "find",
+            ttl,
+            _find,
+            filter,
+            result_format=result_format,
+            schema=schema,
+            **options,
+        )
+
+    @_instrumented
+    def aggregate(
+        self,
+        pipeline: list,
+        ttl: int = 1000,
+        result_format: str = "pandas",
+        schema: pa.Schema = None,
+        **kwargs,
+    ):
+        """
+        Run an aggregation pipeline on the server and retrieve its results.
+
+        Reductions (group by, histograms, top-N) run inside MongoDB so only their results
+        cross the network; see group_count_pipeline, top_n_pipeline, histogram_pipeline and
+        time_buckets_pipeline for common ones.
+
+        Parameters:
+        - pipeline (list): The aggregation stages.
+        - ttl (int): Time-to-live for caching the result, in seconds.
+        - result_format (str): "pandas" for a DataFrame, "arrow" for a pyarrow.Table,
+          "compact" for a DataFrame with compact dtypes (see infer_schema).
+        - schema (pa.Schema): Arrow schema for the "arrow" and "compact" formats, inferred
+          from the documents read if None.
+        - **kwargs: Additional keyword arguments to pass to pymongo.Collection.aggregate, and
+          max_rows and max_bytes to override the connection's limits.
+
+        Returns:
+        pd.DataFrame | pa.Table: The documents output by the pipeline, flagged as truncated
+        if cut by the query guard limits.
+        """
+
+        def _aggregate():
+            if result_format not in ("pandas", "arrow", "compact"):
+                raise ValueError(
+                    f"Unknown result_format '{result_format}', expected 'pandas', 'arrow' or 'compact'"
+                )
+
+            options, max_rows, max_bytes = self._read_options(kwargs, "maxTimeMS")
+            stages = pipeline
+            # pipelines writing their output with $out or $merge return no documents
+            if max_rows is not None and not (
+                pipeline and {"$out", "$merge"} & set(pipeline[-1])
+            ):
+                stages = pipeline + [{"$limit": max_rows + 1}]
+
+            cut = {}
+            if result_format == "pandas":
+                documents = list(
+                    _cap_documents(self._instance.aggregate(stages, **options), max_bytes, cut)
+                )
+                result = pd.DataFrame(_cap_rows(documents, max_rows, cut))
+            else:
+                table = _raw_batches_to_table(
+                    _cap_raw_batches(
+                        self._instance.aggregate_raw_batches(stages, **options), max_bytes, cut
+                    ),
+                    schema,
+                    compact=result_format == "compact",
+                )
+                table = _cap_rows(table, max_rows, cut)
+                result = _compact_frame(table) if result_format == "compact" else table
 
-            return pd.DataFrame(list(cursor))
+            return _mark_truncated(result, cut.get("reason"))
 
-        return _find(filter)
+        return self._cached(
+            "aggregate",
+            ttl,
+            _aggregate,
+            pipeline=pipeline,
+            result_format=result_format,
+            schema=schema,
+            **kwargs,
+        )
 
+    @_instrumented
     def find_one(self, filter: dict = None, ttl: int = 1000, **kwargs) -> pd.Series:
         """
         Find a single document in the MongoDB collection that matches the specified filter.
 
+        Lookups by _id alone go through get_many and share its per-document cache.
+
         Parameters:
         - filter (dict): The filter to apply on the documents (default: None).
         - ttl (int): Time-to-live for caching the result, in seconds.
@@ -106,16 +3744,71 @@ class MongoDBConnection(ExperimentalBaseConnection[pymongo.MongoClient]):
         pd.Series: A pandas Series representing the matching document, or an empty Series if not found.
         """
 
-        def _find_one(filter: dict = None):
-            query = filter or {}
+        query = filter or {}
+        pinned = _pinned_key(query)
+        if pinned is not None and pinned[0] == "_id" and not kwargs:
+            document = self.get_many([pinned[1]], ttl=ttl)[0]
+            return pd.Series(document) if document else pd.Series()
 
+        def _find_one():
             # Perform the find_one operation with additional query options
-            result = self._instance.find_one(query, projection=kwargs.get("projection"))
+            options, _, _ = self._read_options(kwargs)
+            result = self._instance.find_one(query, **options)
 
             return pd.Series(result) if result else pd.Series()
 
-        return _find_one(filter)
+        return self._cached("find_one", ttl, _find_one, query, **kwargs)
+
+    @_instrumented
+    def get_many(self, ids: list, key: str = "_id", ttl: int = 1000) -> list:
+        """
+        Look up documents by the values of a unique field, in one query for all cache misses.
+
+        Documents are cached one by one (see DocumentCache), so overlapping lookups only
+        fetch the documents they do not share, and repeated lookups do not query MongoDB.
+        The connection's update_document and delete_document calls selecting documents by
+        their key keep the cached documents up to date; other writes evict them.
+
+        Parameters:
+        - ids (list): The values of key to look up.
+        - key (str): The unique field to look the documents up by (default: "_id").
+        - ttl (int): Time-to-live for caching the documents, in seconds; 0 disables caching,
+          as does the connection's cache="none".
+
+        Returns:
+        list: The documents in the order of ids, with None for the values no document has.
+        Cached documents are shared, so they must not be modified in place.
+        """
+        namespace = self._instance.full_name
+        cache = self._root._document_cache
+        # cache="none" disables the document cache as well
+        cached = bool(ttl) and self._cache_backend != "none"
+        found = cache.get_many(namespace, key, ids) if cached else {}
+        missing = list(dict.fromkeys(value for value in ids if value not in found))
+
+        if missing:
+            query = {key: {"$in": missing}}
+            self._observe_query("get_many", query, {})
+            generation = self._generation()
+            with self._guarded_read():
+                options, _, _ = self._read_options({})
+                fetched = {
+                    _field_value(document, key): document
+                    for document in self._instance.find(query, **options)
+                }
+            # documents fetched while a write was made may predate it and are not cached
+            if cached and self._generation() == generation:
+                cache.set_many(namespace, key, fetched, ttl)
+            found.update(fetched)
+
+        with self._cache_stats_lock:
+            stats = self._cache_stats.setdefault("get_many", {"hits": 0, "misses": 0})
+            stats["hits"] += len(ids) - len(missing)
+            stats["misses"] += len(missing)
 
+        return [found.get(value) for value in ids]
+
+    @_instrumented
     def insert_document(self, document: dict, **kwargs):
         """
         Insert a single document into the MongoDB collection.
@@ -124,8 +3817,12 @@ class MongoDBConnection(ExperimentalBaseConnection[pymongo.MongoClient]):
         - document (dict): The document to insert.
         - **kwargs: Additional keyword arguments to pass to pymongo.Collection.insert_one.
         """
-        return self._instance.insert_one(document, **kwargs)
+        result = self._instance.insert_one(document, **kwargs)
+        # get_many does not cache missing documents, so inserts leave its cache valid
+        self._bump_generation(documents=False)
+        return result
 
+    @_instrumented
     def insert_many_documents(self, documents: list, **kwargs):
         """
         Insert multiple documents into the MongoDB collection.
@@ -134,8 +3831,11 @@ class MongoDBConnection(ExperimentalBaseConnection[pymongo.MongoClient]):
         - documents (list): A list of documents to insert.
         - **kwargs: Additional keyword arguments to pass to pymongo.Collection.insert_many.
         """
-        return self._instance.insert_many(documents, **kwargs)
+        result = self._instance.insert_many(documents, **kwargs)
+        self._bump_generation(documents=False)
+        return result
 
+    @_instrumented
     def update_document(self, query: dict, update: dict, **kwargs):
         """
         Update a single document in the MongoDB collection that matches the specified query.
@@ -145,8 +3845,14 @@ class MongoDBConnection(ExperimentalBaseConnection[pymongo.MongoClient]):
         - update (dict): The update operation to apply on the matching document.
         - **kwargs: Additional keyword arguments to pass to pymongo.Collection.update_one.
         """
-        return self._instance.update_one(query, {"$set": update}, **kwargs)
+        result = self._instance.update_one(query, {"$set": update}, **kwargs)
+        self._root._document_cache.update(
+            self._instance.full_name, query, update, matched=result.matched_count > 0
+        )
+        self._bump_generation(documents=False)
+        return result
 
+    @_instrumented
     def update_documents(self, query: dict, update: dict, **kwargs):
         """
         Update multiple documents in the MongoDB collection that match the specified query.
@@ -156,8 +3862,11 @@ class MongoDBConnection(ExperimentalBaseConnection[pymongo.MongoClient]):
         - update (dict): The update operation to apply on the matching documents.
         - **kwargs: Additional keyword arguments to pass to pymongo.Collection.update_many.
         """
-        return self._instance.update_many(query, {"$set": update}, **kwargs)
+        result = self._instance.update_many(query, {"$set": update}, **kwargs)
+        self._bump_generation()
+        return result
 
+    @_instrumented
     def delete_document(self, query: dict, **kwargs):
         """
         Delete a single document from the MongoDB collection that matches the specified query.
@@ -166,8 +3875,12 @@ class MongoDBConnection(ExperimentalBaseConnection[pymongo.MongoClient]):
         - query (dict): The query to find the document to delete.
         - **kwargs: Additional keyword arguments to pass to pymongo.Collection.delete_one.
         """
-        return self._instance.delete_one(query, **kwargs)
+        result = self._instance.delete_one(query, **kwargs)
+        self._root._document_cache.discard(self._instance.full_name, query)
+        self._bump_generation(documents=False)
+        return result
 
+    @_instrumented
     def delete_documents(self, query: dict, **kwargs):
         """
         Delete multiple documents from the MongoDB collection that match the specified query.
@@ -176,74 +3889,405 @@ class MongoDBConnection(ExperimentalBaseConnection[pymongo.MongoClient]):
         - query (dict): The query to find the documents to delete.
         - **kwargs: Additional keyword arguments to pass to pymongo.Collection.delete_many.
         """
-        return self._instance.delete_many(query, **kwargs)
+        result = self._instance.delete_many(query, **kwargs)
+        self._bump_generation()
+        return result
+
+    def bulk(
+        self,
+        batch_bytes: int = 8 * 1024 * 1024,
+        ordered: bool = False,
+        retries: int = 3,
+    ) -> BulkWriter:
+        """
+        Create a BulkWriter that buffers writes into bulk_write batches.
+
+        Example:
+            with conn.bulk() as bulk:
+                bulk.insert_frame(frame)
+                bulk.upsert({"name": "Ann"}, {"age": 30})
+            st.write(bulk.report)
+
+        Parameters:
+        - batch_bytes (int): The BSON size at which a batch is sent, in bytes.
+        - ordered (bool): Stop a batch at the first error instead of applying all valid operations.
+        - retries (int): How many times a batch is retried after a transient error.
+
+        Returns:
+        BulkWriter: The writer; the last batch is sent when the with block exits.
+        """
+        return BulkWriter(self, batch_bytes, ordered, retries)
+
+    @_instrumented
+    def export(
+        self,
+        filter: dict = None,
+        path: str = "export.parquet",
+        format: str = None,
+        batch_size: int = 10_000,
+        schema: pa.Schema = None,
+    ) -> dict:
+        """
+        Write the documents matching a filter to a Parquet or Arrow IPC file.
+
+        Documents are streamed with iter_batches and each batch is written as it arrives,
+        as one Parquet row group or IPC record batch, so memory use does not grow with the
+        number of documents. Subdocuments are flattened into dotted columns, ObjectIds
+        become 12-byte binaries that import_file turns back into ObjectIds.
+
+        Example:
+            conn.export({"status": "active"}, "active.parquet")
+
+        Parameters:
+        - filter (dict): The filter to apply on the documents (default: None).
+        - path (str): The file to write.
+        - format (str): "parquet" or "arrow" (Arrow IPC), taken from the extension of path if None.
+        - batch_size (int): The number of documents per row group or record batch.
+        - schema (pa.Schema): The columns to write. If None, they are inferred with
+          infer_schema, then completed and widened with the fields and types found by a key
+          pass over all the matching documents, one more read of them per level of
+          subdocuments (see _field_types).
+
+        Returns:
+        dict: The number of documents and batches written, the file size in bytes, the time
+        taken in seconds and the throughput in documents per second.
+        """
+        format = _file_format(path, format)
+        start = time.perf_counter()
+
+        if schema is None:
+            schema = self.infer_schema(filter)
+            # the sample sets the column types, but may miss rare fields and types: a key
+            # pass over all the documents finds them, a sample of the documents holding the
+            # missing fields types them, and fields holding other types are widened
+            field_types = self._field_types(filter)
+            missing = sorted(
+                name
+                for name in field_types
+                if name not in schema.names
+                and not any(name.startswith(f"{field}.") for field in schema.names)
+            )
+            if missing:
+                pipeline = _match_stage(filter) + [
+                    {"$match": {"$or": [{name: {"$exists": True}} for name in missing]}},
+                    {"$sample": {"size": 1000}},
+                ]
+                sampled = _infer_schema(list(self._instance.aggregate(pipeline)), compact=True)
+                schema = pa.schema(
+                    list(schema)
+                    + [
+                        sampled.field(name)
+                        if name in sampled.names
+                        else pa.field(name, pa.string())
+                        for name in missing
+                    ],
+                    metadata=schema.metadata,
+                )
+            schema = pa.schema(
+                [
+                    _widen_field(
+                        field,
+                        {
+                            _BSON_KINDS.get(type, object)
+                            for type in field_types.get(field.name, ())
+                            if type != "null"
+                        },
+                        [],
+                        compact=True,
+                    )
+                    for field in schema
+                ],
+                metadata=schema.metadata,
+            )
+        if format == "arrow":
+            # IPC files can't hold a different dictionary in every record batch
+            schema = pa.schema(
+                [
+                    field.with_type(field.type.value_type)
+                    if pa.types.is_dictionary(field.type)
+                    else field
+                    for field in schema
+                ]
+            )
+
+        if format == "parquet":
+            writer = pq.ParquetWriter(path, schema)
+        else:
+            writer = pa.ipc.new_file(path, schema)
+
+        documents = batches = 0
+        try:
+            with writer:
+                for record_batch in self.iter_batches(
+                    filter, batch_size, result_format="arrow", schema=schema
+                ):
+                    writer.write_batch(record_batch)
+                    documents += record_batch.num_rows
+                    batches += 1
+        except BaseException:
+            # don't leave a truncated file that looks like a complete export
+            os.remove(path)
+            raise
+
+        seconds = time.perf_counter() - start
+        return {
+            "documents": documents,
+            "batches": batches,
+            "bytes": os.path.getsize(path),
+            "seconds": seconds,
+            "documents_per_second": documents / seconds if seconds else None,
+        }
+
+    @_instrumented
+    def import_file(
+        self,
+        path: str,
+        format: str = None,
+        batch_size: int = 10_000,
+        batch_bytes: int = 8 * 1024 * 1024,
+        ordered: bool = False,
+        retries: int = 3,
+    ) -> dict:
+        """
+        Insert the rows of a Parquet or Arrow IPC file into the collection as documents.
+
+        The file is read one record batch at a time and converted to documents by Arrow,
+        column by column. While a batch is inserted by a BulkWriter on a worker thread
+        (in bulk_write batches of at most batch_bytes), the next one is read and converted, so reading and writing overlap and at most two
+        batches are held in memory. Dotted columns become subdocuments again and columns
+        tagged as ObjectIds by export become ObjectIds. Nulls are left out of the documents,
+        since a file can't tell a null from a missing field.
+
+        Parameters:
+        - path (str): The file to read, e.g. one written by export.
+        - format (str): "parquet" or "arrow" (Arrow IPC), taken from the extension of path if None.
+        - batch_size (int): The number of rows converted at a time.
+        - batch_bytes (int): The BSON size at which a bulk_write batch is sent, in bytes.
+        - ordered (bool): Stop a batch at the first error instead of applying all valid operations.
+        - retries (int): How many times a batch is retried after a transient error.
+
+        Returns:
+        dict: The number of documents inserted and bulk_write batches sent, the time taken in
+        seconds and the throughput in documents per second.
+        """
+        format = _file_format(path, format)
+        start = time.perf_counter()
+
+        if format == "parquet":
+            record_batches = pq.ParquetFile(path).iter_batches(batch_size=batch_size)
+        else:
+            reader = pa.ipc.open_file(pa.memory_map(path))
+            record_batches = (
+                chunk
+                for i in range(reader.num_record_batches)
+                for chunk in pa.Table.from_batches([reader.get_batch(i)]).to_batches(
+                    max_chunksize=batch_size
+                )
+            )
+
+        def _insert(documents: list):
+            for document in documents:
+                writer.insert(document)
+            writer.flush()
+
+        documents = 0
+        writer = BulkWriter(self, batch_bytes, ordered, retries)
+        # one worker, so the BulkWriter is only used by one thread at a time
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="mongodb-connection-import"
+        ) as executor:
+            pending = None
+            for record_batch in record_batches:
+                batch = [
+                    _unflatten_document(
+                        {name: value for name, value in document.items() if value is not None}
+                    )
+                    for document in _record_batch_to_documents(record_batch)
+                ]
+                if pending is not None:
+                    pending.result()
+                pending = executor.submit(_insert, batch)
+                documents += len(batch)
+            if pending is not None:
+                pending.result()
 
-    def count_documents(self, query: dict, ttl: int = 1000, **kwargs):
+        seconds = time.perf_counter() - start
+        return {
+            "documents": documents,
+            "batches": len(writer.report),
+            "seconds": seconds,
+            "documents_per_second": documents / seconds if seconds else None,
+        }
+
+    @_instrumented
+    def count_documents(
+        self,
+        query: dict,
+        ttl: int = 1000,
+        approximate: bool = False,
+        sample_size: int = 1000,
+        confidence: float = 0.95,
+        **kwargs,
+    ):
         """
         Count the number of documents in the MongoDB collection that match the specified query.
 
+        An exact count reads every matching document (or index key). An approximate count
+        reads the collection's metadata for an empty query, and otherwise tests the query
+        on a random $sample of sample_size documents.
+
         Parameters:
         - query (dict): The query to count the documents.
         - ttl (int): Time-to-live for caching the result, in seconds.
+        - approximate (bool): Return a CountEstimate instead of an exact count.
+        - sample_size (int): The number of documents sampled for an approximate count.
+        - confidence (float): The confidence level of the bounds of an approximate count.
         - **kwargs: Additional keyword arguments to pass to pymongo.Collection.count_documents.
 
         Returns:
-        int: The number of documents that match the query.
+        int | CountEstimate: The number of documents that match the query, or its estimate
+        with the low and high bounds of its confidence interval.
         """
 
-        @cache_data(ttl=ttl)
-        def _count_documents(query: dict, **kwargs):
-            return self._instance.count_documents(query, **kwargs)
+        if approximate:
+
+            def _estimate_documents():
+                total = self._instance.estimated_document_count()
+                if not query:
+                    return CountEstimate(total, total, total, False)
+                options, _, _ = self._read_options(kwargs, "maxTimeMS")
+                # small collections are counted exactly, at the cost of a sample
+                if total <= sample_size:
+                    count = self._instance.count_documents(query, **options)
+                    return CountEstimate(count, count, count, True)
+
+                pipeline = [{"$sample": {"size": sample_size}}, {"$match": query}, {"$count": "count"}]
+                options, _, _ = self._read_options({}, "maxTimeMS")
+                matched = next(self._instance.aggregate(pipeline, **options), {"count": 0})["count"]
+                return _estimate_count(matched, sample_size, total, confidence)
+
+            return self._cached(
+                "approximate_count",
+                ttl,
+                _estimate_documents,
+                query,
+                sample_size=sample_size,
+                confidence=confidence,
+                **kwargs,
+            )
+
+        def _count_documents():
+            options, _, _ = self._read_options(kwargs, "maxTimeMS")
+            return self._instance.count_documents(query, **options)
 
-        return _count_documents(query, **kwargs)
+        return self._cached("count_documents", ttl, _count_documents, query, **kwargs)
 
+    @_instrumented
     def distinct_values(
-        self, field: str, query: dict = None, ttl: int = 1000, **kwargs
+        self, field: str, query: dict = None, ttl: int = 1000, limit: int = None, **kwargs
     ):
         """
         Retrieve distinct values for a given field in the MongoDB collection.
 
+        With a limit, the values are grouped, sorted and cut on the server by an
+        aggregation, so only limit values are downloaded.
+
         Parameters:
         - field (str): The field for which to retrieve distinct values.
         - query (dict): The query to filter the documents (default: None).
         - ttl (int): Time-to-live for caching the result, in seconds.
-        - **kwargs: Additional keyword arguments to pass to pymongo.Collection.distinct.
+        - limit (int): Only return the limit smallest values (default: None, all values).
+        - **kwargs: Additional keyword arguments to pass to pymongo.Collection.distinct
+          (or pymongo.Collection.aggregate with a limit).
 
         Returns:
         list: A list of distinct values for the specified field.
         """
 
-        @cache_data(ttl=ttl)
-        def _distinct_values(field: str, query: dict = None, **kwargs):
-            return self._instance.distinct(field, filter=query, **kwargs)
+        def _distinct_values():
+            options, _, _ = self._read_options(kwargs, "maxTimeMS")
+            if limit is None:
+                return self._instance.distinct(field, filter=query, **options)
+
+            # like distinct, array values count as each of their elements
+            pipeline = _match_stage(query) + [
+                {"$unwind": f"${field}"},
+                {"$group": {"_id": f"${field}"}},
+                {"$sort": {"_id": pymongo.ASCENDING}},
+                {"$limit": limit},
+            ]
+            return [document["_id"] for document in self._instance.aggregate(pipeline, **options)]
+
+        return self._cached(
+            "distinct_values", ttl, _distinct_values, query, field=field, limit=limit, **kwargs
+        )
+
+    @_instrumented
+    def top_values(self, field: str, n: int = 10, query: dict = None, ttl: int = 1000):
+        """
+        Retrieve the most frequent values of a field with their counts, computed on the server.
+
+        Parameters:
+        - field (str): The field to count the values of; dotted paths are allowed.
+        - n (int): The number of values to return.
+        - query (dict): The query to filter the documents (default: None).
+        - ttl (int): Time-to-live for caching the result, in seconds.
 
-        return _distinct_values(field, query, **kwargs)
+        Returns:
+        pd.DataFrame: At most n rows with the value and its "count", most frequent first.
+        """
+        return self.aggregate(top_n_pipeline(field, n, query), ttl=ttl)
 
-    def query(self, query: dict, ttl: int = 3600, **kwargs) -> pd.DataFrame:
+    @_instrumented
+    def query(
+        self,
+        query: dict,
+        ttl: int = 3600,
+        result_format: str = "pandas",
+        schema: pa.Schema = None,
+        **kwargs,
+    ):
         """
         Execute a custom query on the MongoDB collection and retrieve the results as a DataFrame.
 
         Parameters:
         - query (dict): The custom query to execute.
         - ttl (int): Time-to-live for caching the result, in seconds.
-        - **kwargs: Additional keyword arguments to pass to pymongo.Collection.find.
+        - result_format (str): "pandas" for a DataFrame, "arrow" for a pyarrow.Table,
+          "compact" for a DataFrame with compact dtypes (see infer_schema).
+        - schema (pa.Schema): Arrow schema for the "arrow" and "compact" formats, inferred
+          if None; only its fields are fetched.
+        - **kwargs: Additional keyword arguments to pass to pymongo.Collection.find, and
+          max_rows and max_bytes to override the connection's limits.
 
         Returns:
-        pd.DataFrame: A DataFrame containing the results of the custom query.
+        pd.DataFrame | pa.Table: The results of the custom query, flagged as truncated if cut
+        by the query guard limits (see truncated()).
         """
 
-        @cache_data(ttl=ttl)
-        def _query(query: dict, **kwargs) -> pd.DataFrame:
-            return pd.DataFrame(list(self._instance.find(query, **kwargs)))
+        def _query():
+            return self._fetch(query, result_format, schema, **kwargs)
 
-        return _query(query, **kwargs)
+        return self._cached(
+            "query",
+            ttl,
+            _query,
+            query,
+            result_format=result_format,
+            schema=schema,
+            **kwargs,
+        )
 
+    @_instrumented
     def paginate_documents(
         self, page_number: int, items_per_page: int, ttl: int = 1000
     ) -> pd.DataFrame:
         """
         Paginate through the MongoDB collection and retrieve documents for the specified page.
 
+        The server walks all skipped documents, so deep pages get slower; use
+        paginate_keyset to page through large collections.
+
         Parameters:
         - page_number (int): The page number to retrieve (1-based).
         - items_per_page (int): The number of items to retrieve per page.
@@ -253,17 +4297,354 @@ class MongoDBConnection(ExperimentalBaseConnection[pymongo.MongoClient]):
         pd.DataFrame: A DataFrame containing the documents for the specified page.
         """
 
-        @cache_data(ttl=ttl)
-        def _paginate_documents(page_number: int, items_per_page: int) -> pd.DataFrame:
+        def _paginate_documents() -> pd.DataFrame:
             # Calculate the number of documents to skip based on the page number and items per page
             skip_count = (page_number - 1) * items_per_page
 
             # Perform the query with pagination
-            documents = self._instance.find().skip(skip_count).limit(items_per_page)
+            options, _, _ = self._read_options({})
+            documents = self._instance.find(**options).skip(skip_count).limit(items_per_page)
             return pd.DataFrame(list(documents))
 
-        return _paginate_documents(page_number, items_per_page)
+        return self._cached(
+            "paginate_documents",
+            ttl,
+            _paginate_documents,
+            page_number=page_number,
+            items_per_page=items_per_page,
+        )
+
+    @_instrumented
+    def paginate_keyset(
+        self,
+        items_per_page: int,
+        token: str = None,
+        filter: dict = None,
+        sort_key: str = "_id",
+        direction: int = 1,
+        prefetch: bool = False,
+        ttl: int = 1000,
+        result_format: str = "pandas",
+    ):
+        """
+        Paginate through the MongoDB collection by seeking on an indexed sort key.
+
+        Unlike paginate_documents, no documents are skipped on the server: each page is an
+        index range scan starting after the last document of the previous page, so every page
+        costs O(items_per_page) however deep it is. Ties on the sort key are broken by _id, so
+        an index on (sort_key, _id) should exist when sort_key is not _id. sort_key may be a
+        dotted field; documents missing it are paged like those where it is null. Keys of
+        different BSON types are paged in MongoDB's order across types (numbers, strings,
+        objects, ...); array keys are not supported. A malformed token raises ValueError.
+
+        Parameters:
+        - items_per_page (int): The number of items to retrieve per page.
+        - token (str): The continuation token returned with the previous page, None for the first page.
+        - filter (dict): The filter to apply on the documents (default: None).
+        - sort_key (str): The field to order and seek on (default: "_id").
+        - direction (int): pymongo.ASCENDING (default) or pymongo.DESCENDING.
+        - prefetch (bool): Fetch the following page in the background so it is cached when requested.
+        - ttl (int): Time-to-live for caching the result, in seconds.
+        - result_format (str): "pandas" for a DataFrame, "arrow" for a pyarrow.Table.
+
+        Returns:
+        tuple: The page (pd.DataFrame | pa.Table) and the token for the next page, None on the last page.
+        """
+
+        def _paginate_keyset(token: str):
+            query = filter or {}
+            comparison = "$gt" if direction == pymongo.ASCENDING else "$lt"
+
+            if token is not None:
+                try:
+                    position = bson.decode(base64.urlsafe_b64decode(token))
+                    last_id = position["_id"]
+                    key = position["key"] if sort_key != "_id" else None
+                except (ValueError, TypeError, KeyError, bson.errors.BSONError) as e:
+                    raise ValueError("invalid continuation token") from e
+
+                if sort_key == "_id":
+                    seek = {"_id": {comparison: last_id}}
+                else:
+                    # MongoDB sorts a missing or null key before any value: after the last
+                    # of them come all keys with a value, and before the first of them none
+                    after = [{sort_key: key, "_id": {comparison: last_id}}]
+                    if key is None:
+                        if direction == pymongo.ASCENDING:
+                            after.append({sort_key: {"$ne": None}})
+                    else:
+                        # comparisons only match values of the key's own type, the keys of
+                        # the types sorting after it (before it when descending) follow it
+                        after.append({sort_key: {comparison: key}})
+                        bracket = _sort_bracket(key)
+                        if bracket is not None:
+                            if direction == pymongo.ASCENDING:
+                                following = _BSON_SORT_ORDER[bracket + 1 :]
+                            else:
+                                following = _BSON_SORT_ORDER[1:bracket]
+                                after.append({sort_key: None})
+                            after.extend({sort_key: {"$type": name}} for name, _ in following)
+                    seek = {"$or": after}
+                query = {"$and": [query, seek]} if query else seek
+
+            sort = [(sort_key, direction)]
+            if sort_key != "_id":
+                sort.append(("_id", direction))
+
+            # one extra document tells whether a next page exists
+            options, _, _ = self._read_options({})
+            documents = list(
+                self._instance.find(query, sort=sort, limit=items_per_page + 1, **options)
+            )
+            next_token = None
+            if len(documents) > items_per_page:
+                documents = documents[:items_per_page]
+                last = documents[-1]
+                position = {"_id": last["_id"], "key": _field_value(last, sort_key)}
+                next_token = base64.urlsafe_b64encode(bson.encode(position)).decode()
+
+            if result_format == "arrow":
+                page = pa.Table.from_batches(
+                    [_documents_to_record_batch(documents, _infer_schema(documents))]
+                )
+            else:
+                page = pd.DataFrame(documents)
+
+            return page, next_token
+
+        def _page(token: str):
+            return self._cached(
+                "paginate_keyset",
+                ttl,
+                lambda: _paginate_keyset(token),
+                filter,
+                token=token,
+                items_per_page=items_per_page,
+                sort_key=sort_key,
+                direction=direction,
+                result_format=result_format,
+            )
+
+        page, next_token = _page(token)
+
+        if prefetch and next_token is not None:
+            self._submit(_page, next_token)
+
+        return page, next_token
+
+    @_instrumented
+    def watch_frame(
+        self,
+        filter: dict = None,
+        projection: dict = None,
+        mode: str = "auto",
+        poll_interval: float = 5.0,
+        timeout: float = 1.0,
+    ) -> pd.DataFrame:
+        """
+        Read the documents matching a filter from a result kept up to date in the background.
+
+        The first call loads the result into a LiveFrame; later calls (and reruns) return it
+        without querying MongoDB, as a change stream applies the collection's inserts,
+        updates and deletes to it row by row. Without change streams (standalone servers)
+        the result is reloaded every poll_interval seconds and after this connection's writes.
+        At most live_frames_max results are kept, the least recently read is closed beyond
+        it; close_live_frames closes them all.
+
+        Parameters:
+        - filter (dict): The filter to apply on the documents (default: None).
+        - projection (dict): The fields to fetch; _id is always fetched.
+        - mode (str): "change_stream", "poll", or "auto" to poll only when change streams
+          are not available.
+        - poll_interval (float): How often the result is reloaded when polling, in seconds.
+        - timeout (float): The longest wait for this connection's latest write to reach the
+          result, in seconds.
+
+        Returns:
+        pd.DataFrame: The matching documents indexed by _id, read-only (see _result_view).
+        """
+        key = _fingerprint(
+            "watch_frame",
+            filter,
+            namespace=self._instance.full_name,
+            projection=projection,
+            mode=mode,
+        )
+
+        root = self._root
+        with root._live_frames_lock:
+            live_frame = root._live_frames.get(key)
+            if live_frame is None or live_frame.closed:
+                live_frame = LiveFrame(self, filter, projection, mode, poll_interval)
+                root._live_frames[key] = live_frame
+            root._live_frames.move_to_end(key)
+
+            # each result has a thread and a change stream of its own
+            while len(root._live_frames) > root._live_frames_max:
+                _, evicted = root._live_frames.popitem(last=False)
+                evicted.close()
+
+        return live_frame.frame(timeout)
+
+    def close_live_frames(self):
+        """
+        Stop keeping the results of watch_frame up to date, for this connection and its
+        collection handles. Later calls to watch_frame load their result again.
+        """
+        root = self._root
+        with root._live_frames_lock:
+            live_frames = list(root._live_frames.values())
+            root._live_frames.clear()
+
+        for live_frame in live_frames:
+            live_frame.close()
+
+    def _duckdb_connection(self) -> duckdb.DuckDBPyConnection:
+        """Return the DuckDB database shared by all collection handles, opening it on first use."""
+        root = self._root
+        if root._duckdb is None:
+            root._duckdb = duckdb.connect(root._duckdb_path)
+            root._duckdb.execute(
+                "CREATE TABLE IF NOT EXISTS _snapshots "
+                "(name VARCHAR PRIMARY KEY, high_water BLOB)"
+            )
+        return root._duckdb
+
+    @_instrumented
+    def snapshot(
+        self,
+        name: str,
+        filter: dict = None,
+        projection: dict = None,
+        incremental_field: str = "_id",
+        full: bool = False,
+        batch_size: int = 10_000,
+    ) -> int:
+        """
+        Materialize the collection, or a filtered projection of it, into a DuckDB table.
+
+        The first call loads every matching document. Later calls only load the documents
+        whose incremental_field is past the high-water mark of the previous load: with "_id",
+        new documents are appended; with a modification date such as "updatedAt", changed
+        documents replace their previous version. Deletions are only picked up by a full reload.
+        Fields first seen in a later batch or load are added as columns. The table can then be queried with conn.sql without going back to MongoDB.
+
+        Parameters:
+        - name (str): The name of the DuckDB table.
+        - filter (dict): The filter to apply on the documents (default: None).
+        - projection (dict): The fields to keep; must include _id and incremental_field.
+        - incremental_field (str): An indexed, increasing field to refresh on (default: "_id").
+        - full (bool): Drop the table and reload it entirely.
+        - batch_size (int): The number of documents loaded at a time.
+
+        Returns:
+        int: The number of documents loaded.
+        """
+        table = '"' + name.replace('"', '""') + '"'
+
+        with self._root._duckdb_lock:
+            con = self._duckdb_connection()
+            if full:
+                con.execute(f"DROP TABLE IF EXISTS {table}")
+                con.execute("DELETE FROM _snapshots WHERE name = ?", [name])
+
+            row = con.execute(
+                "SELECT high_water FROM _snapshots WHERE name = ?", [name]
+            ).fetchone()
+            exists = row is not None
+            schema = None
+            query = filter or {}
+
+            if exists:
+                schema = con.execute(f"SELECT * FROM {table} LIMIT 0").arrow().schema
+                high_water = bson.decode(row[0])["value"]
+                # equal modification dates may belong to documents written after the last load
+                comparison = "$gt" if incremental_field == "_id" else "$gte"
+                seek = {incremental_field: {comparison: high_water}}
+                query = {"$and": [query, seek]} if query else seek
+
+            raw_batches = self._instance.find_raw_batches(
+                query,
+                projection=projection,
+                sort=[(incremental_field, pymongo.ASCENDING)],
+                batch_size=batch_size,
+            )
+
+            def _remember_last(raw_batches):
+                nonlocal last_raw_batch
+                for raw_batch in raw_batches:
+                    if raw_batch:
+                        last_raw_batch = raw_batch
+                    yield raw_batch
+
+            loaded = 0
+            last_raw_batch = None
+            batches = _iter_record_batches(_remember_last(raw_batches), schema, widen=True)
+            for record_batch in batches:
+                con.register("_snapshot_batch", pa.Table.from_batches([record_batch]))
+                if not exists:
+                    con.execute(f"CREATE TABLE {table} AS SELECT * FROM _snapshot_batch")
+                    exists = True
+                else:
+                    # fields first seen in this batch become new columns, null for older rows,
+                    # and widened fields (see _widen_field) change the type of their column
+                    columns = dict(
+                        row[:2] for row in con.execute(f"DESCRIBE {table}").fetchall()
+                    )
+                    for column, column_type, *_ in con.execute(
+                        "DESCRIBE SELECT * FROM _snapshot_batch"
+                    ).fetchall():
+                        quoted = '"' + column.replace('"', '""') + '"'
+                        if column not in columns:
+                            con.execute(f"ALTER TABLE {table} ADD COLUMN {quoted} {column_type}")
+                        elif columns[column] != column_type:
+                            con.execute(
+                                f"ALTER TABLE {table} ALTER COLUMN {quoted} TYPE {column_type}"
+                            )
+                    if incremental_field != "_id":
+                        con.execute(
+                            f"DELETE FROM {table} WHERE _id IN (SELECT _id FROM _snapshot_batch)"
+                        )
+                    con.execute(f"INSERT INTO {table} BY NAME SELECT * FROM _snapshot_batch")
+                con.unregister("_snapshot_batch")
+
+                loaded += record_batch.num_rows
+
+            # the mark is taken from the BSON document: the table of an existing snapshot,
+            # read back from DuckDB, no longer tells ObjectId columns from binary ones
+            if loaded:
+                last = bson.decode_all(last_raw_batch)[-1]
+                con.execute(
+                    "INSERT OR REPLACE INTO _snapshots VALUES (?, ?)",
+                    [name, bson.encode({"value": _field_value(last, incremental_field)})],
+                )
+
+        return loaded
+
+    @_instrumented
+    def sql(self, query: str, parameters: list = None, result_format: str = "pandas"):
+        """
+        Run an SQL query on the DuckDB snapshots created with conn.snapshot.
+
+        Example:
+            conn.snapshot("orders")
+            conn.sql("SELECT status, count(*) FROM orders GROUP BY status")
+
+        Parameters:
+        - query (str): The SQL query; snapshots are tables named after them.
+        - parameters (list): Values for the query's ? placeholders (default: None).
+        - result_format (str): "pandas" for a DataFrame, "arrow" for a pyarrow.Table.
+
+        Returns:
+        pd.DataFrame | pa.Table: The result of the query.
+        """
+        with self._root._duckdb_lock:
+            result = self._duckdb_connection().execute(query, parameters)
+            return result.arrow() if result_format == "arrow" else result.df()
 
     # def close(self):
     #     self.client.close()
     #     return "Connection closed"
+
+
+_IMPORT_SECONDS = time.perf_counter() - _IMPORT_STARTED
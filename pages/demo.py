@@ -1,6 +1,6 @@
 # import pwd_
 import streamlit as st
-from mongodb_conn import MongoDBConnection
+from mongodb_conn import MongoDBConnection, histogram_pipeline, parse_query, truncated
 from streamlit_option_menu import option_menu
 
 # Fake things ahead !!!
@@ -30,17 +30,42 @@ if selected == "Connect":
     st.write(conn)
     st.help(conn)
 
+    # "connecting" while a connect_in_background connection is being set up
+    st.write("Connection state:", conn.connection_state)
+
+    # latencies, cache hit rates, slow queries and cold start timings of this connection
+    conn.debug_panel()
+
 elif selected == "Read":
     st.header("Showing All Documents")
 
     # fetch all documents from the collection
     data = conn.show_all_documents(ttl=1000)
 
-    # display the data
+    # display the data, and whether the connection's limits cut it
+    if truncated(data):
+        st.warning(
+            f"Showing the first {len(data)} documents: the result was cut at {truncated(data)}"
+        )
     st.dataframe(data)
 
     st.divider()
 
+    st.header("Reading in Batches")
+
+    # stream the collection in small chunks, rows are shown as each chunk arrives
+    batches = conn.iter_batches(batch_size=5)
+    first_batch = next(batches, None)
+
+    if first_batch is None:
+        st.info("The collection is empty")
+    else:
+        table = st.dataframe(first_batch)
+        for batch in batches:
+            table.add_rows(batch)
+
+    st.divider()
+
     st.header("Reading with Pagination")
 
     # Values to use for pagination
@@ -48,12 +73,48 @@ elif selected == "Read":
     number_of_docs = st.slider("Number of Docs", 1, 10, 6)
 
     # perform the pagination and display the data
-    st.dataframe(
-        conn.paginate_documents(
-            page_number=page_number,
-            items_per_page=number_of_docs,
-            ttl=1000,
-        ),
+    page = conn.paginate_documents(
+        page_number=page_number,
+        items_per_page=number_of_docs,
+        ttl=1000,
+    )
+    if truncated(page):
+        st.warning(
+            f"Showing the first {len(page)} documents: the result was cut at {truncated(page)}"
+        )
+    st.dataframe(page)
+
+    st.divider()
+
+    st.header("Reading with Keyset Pagination")
+
+    # tokens of the pages visited so far, the last one is the current page
+    if "page_tokens" not in st.session_state:
+        st.session_state["page_tokens"] = [None]
+    page_tokens = st.session_state["page_tokens"]
+
+    # the next page is fetched in the background while this one is displayed
+    page, next_token = conn.paginate_keyset(
+        items_per_page=number_of_docs,
+        token=page_tokens[-1],
+        prefetch=True,
+        ttl=1000,
+    )
+    if truncated(page):
+        st.warning(
+            f"Showing the first {len(page)} documents: the result was cut at {truncated(page)}"
+        )
+    st.dataframe(page)
+
+    previous_column, next_column = st.columns(2)
+    previous_column.button(
+        "Previous Page", disabled=len(page_tokens) == 1, on_click=page_tokens.pop
+    )
+    next_column.button(
+        "Next Page",
+        disabled=next_token is None,
+        on_click=page_tokens.append,
+        args=(next_token,),
     )
 
 
@@ -85,8 +146,12 @@ elif selected == "Write":
             st.session_state["written"] = True
 
         if st.button("Show All Documents after Update", key="show_all"):
-            # kept ttl=0 so that it will not be cached and updated data will be shown
-            data = conn.show_all_documents(ttl=0)
+            # writes invalidate the cached reads, so the updated data will be shown
+            data = conn.show_all_documents(ttl=1000)
+            if truncated(data):
+                st.warning(
+                    f"Showing the first {len(data)} documents: the result was cut at {truncated(data)}"
+                )
             st.dataframe(data,  )
 
     st.divider()
@@ -113,8 +178,12 @@ elif selected == "Write":
         st.write("Inserted document IDs:", result.inserted_ids)
 
         st.write("Showing All Documents after Insertion")
-        # kept ttl=0 so that it will not be cached and updated data will be shown
-        data = conn.show_all_documents(ttl=0)
+        # writes invalidate the cached reads, so the updated data will be shown
+        data = conn.show_all_documents(ttl=1000)
+        if truncated(data):
+            st.warning(
+                f"Showing the first {len(data)} documents: the result was cut at {truncated(data)}"
+            )
         st.dataframe(data)
 
 
@@ -137,9 +206,9 @@ if selected == "Update":
     # display the result, if 0 it means no document was updated
     st.write("Update result:", result.modified_count)
 
-    # display the updated data
-    data = conn.show_all_documents(ttl=0)
-    st.dataframe(data,  )
+    # display the updated data, kept up to date from the collection's changes
+    data = conn.watch_frame()
+    st.dataframe(data)
 
     st.divider()
     st.header("Update Multiple Documents")
@@ -159,7 +228,7 @@ if selected == "Update":
     st.write("Update result for old:", result.modified_count)
 
     # display the updated data
-    data = conn.show_all_documents(ttl=0)
+    data = conn.watch_frame()
     st.dataframe(data)
 
 
@@ -179,8 +248,8 @@ if selected == "Delete":
     result = conn.delete_document(query_delete)
     st.write("Deletion count: ", result.deleted_count)
     
-    # display the updated data
-    data = conn.show_all_documents(ttl=0)
+    # display the updated data, kept up to date from the collection's changes
+    data = conn.watch_frame()
     st.dataframe(data)
 
     st.divider()
@@ -206,19 +275,32 @@ if selected == "Delete":
 
 
 if selected == "query":
-    query_filter = st.text_input("Enter your Mongo Query")
-    # query_filter = {"age": {"$gte": 25}, }
+    query_filter = st.text_input(
+        "Enter your Mongo Query", placeholder='{"age": {"$gte": 25}}'
+    )
+    # the text is parsed as Extended JSON, never evaluated as Python
     try:
-        query_filter = eval(query_filter)
-        st.success("Running query: " + str(query_filter))
-    except Exception as e:
+        query_filter = parse_query(query_filter)
+    except ValueError as e:
         st.error(e)
         query_filter = {}
+    if query_filter:
+        st.success("Running query: " + str(query_filter))
+    else:
         st.info("Running default query: All")
 
-    result = conn.query(query=query_filter, ttl=1000)
+    # a typed query can't pull the whole collection into the page or run for long
+    result = conn.query(query=query_filter, ttl=1000, max_rows=1000, max_time_ms=5000)
+    if truncated(result):
+        st.warning(
+            f"Showing the first {len(result)} documents: the result was cut at {truncated(result)}"
+        )
     st.write(result)
 
+    # the query shapes run so far, and whether an index serves them
+    with st.expander("Index report"):
+        st.dataframe(conn.index_report())
+
 if selected == "Extra":
     st.header("Extra Features")
 
@@ -239,20 +321,75 @@ if selected == "Extra":
     count = conn.count_documents(query)
     st.write("Number of young people:", count)
 
+    # a sampled estimate is enough for a rough number and does not read every match
+    st.code(
+        """
+            estimate = conn.count_documents(query, approximate=True)
+            st.write("About", estimate.value, "young people, between", estimate.low, "and", estimate.high)
+            """
+    )
+    estimate = conn.count_documents(query, approximate=True)
+    st.write("About", estimate.value, "young people, between", estimate.low, "and", estimate.high)
+
     st.subheader("Distinct Values")
     # Get distinct values of a field in the collection
     st.write("The code")
     st.code(
         """
             field_name = "name"
-            distinct_values = conn.distinct_values(field_name)
+            distinct_values = conn.distinct_values(field_name, limit=10)
             st.write("Distinct names:", distinct_values)
 
             """
     )
     field_name = "name"
-    distinct_values = conn.distinct_values(field_name)
+    # only the first 10 names are sent by the server
+    distinct_values = conn.distinct_values(field_name, limit=10)
     st.info("Displaying only first 10 names")
-    st.write("Distinct names:", distinct_values[0:10])
+    st.write("Distinct names:", distinct_values)
+
+    st.subheader("Most Frequent Values")
+    st.write("The code")
+    st.code(
+        """
+            top_names = conn.top_values("name", n=5)
+            st.dataframe(top_names)
+            """
+    )
+    top_names = conn.top_values("name", n=5)
+    st.dataframe(top_names)
     
+    st.subheader("Aggregation")
+    # Group and count on the server, only the per-bucket counts are downloaded
+    st.write("The code")
+    st.code(
+        """
+            from mongodb_conn import histogram_pipeline
+
+            age_histogram = conn.aggregate(histogram_pipeline("age", buckets=5))
+            st.bar_chart(age_histogram, x="min", y="count")
+            """
+    )
+    age_histogram = conn.aggregate(histogram_pipeline("age", buckets=5))
+    if not age_histogram.empty:
+        st.bar_chart(age_histogram, x="min", y="count")
+
+    st.subheader("Concurrent Reads")
+    # Run independent reads at the same time, the page waits for the slowest one only
+    st.write("The code")
+    st.code(
+        """
+            count, distinct_values = conn.gather(
+                lambda: conn.count_documents({"status": "old"}),
+                lambda: conn.distinct_values("age"),
+            )
+            """
+    )
+    count, distinct_values = conn.gather(
+        lambda: conn.count_documents({"status": "old"}),
+        lambda: conn.distinct_values("age"),
+    )
+    st.write("Number of old people:", count)
+    st.write("Distinct ages:", distinct_values)
+
     st.error("Find and Find all functions haven't been covered in this demo. Please refer to the documentation for more details")